@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MfProject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up, as it uses the ORM and settings
+from portfolio.live import LivePushApplication  # noqa: E402
+
+# /users/live streams holdings values as NAVs are loaded, see portfolio.live
+application = LivePushApplication(django_application)
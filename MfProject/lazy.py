@@ -0,0 +1,20 @@
+"""Deferred imports for heavy libraries like pandas and numpy"""
+
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Returns a module that is only executed on first attribute access.
+        Keeps manage.py commands and endpoints that never touch the module from paying its import cost."""
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,103 @@
+"""Routing of read-only queries to the read replicas and the fund snapshot in DATABASES"""
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_started
+from django.db import connections
+from django.db.utils import OperationalError
+
+# Apps whose reads must see their own writes immediately, e.g. a token right after login
+PRIMARY_APPS = {'auth', 'authtoken', 'sessions', 'contenttypes', 'admin'}
+
+_local = threading.local()
+_unhealthy = {}
+
+
+def replicas():
+    """Aliases of the configured read replicas"""
+
+    return [i for i in settings.DATABASES if i.startswith('replica')]
+
+
+def mark_write(user_id=None):
+    """Record a write, so that the rest of this request and, for REPLICA_STICKY_SECONDS, the user's
+        following requests read from the primary and see the write despite replication lag"""
+
+    _local.pinned = True
+    if user_id is not None and replicas():
+        caches['portfolio'].set(f'replica-sticky:{user_id}', True, settings.REPLICA_STICKY_SECONDS)
+
+
+def unpin(**kwargs):
+    """Forget the writes and the replica checks of the previous request handled by this thread"""
+
+    _local.pinned = False
+    _local.checked = set()
+
+
+request_started.connect(unpin)
+
+
+def read_alias(user_id=None):
+    """Alias of the database to read from: a healthy replica, unless a recent write needs the primary"""
+
+    candidates = replicas()
+    if not candidates or getattr(_local, 'pinned', False):
+        return 'default'
+    if user_id is not None and caches['portfolio'].get(f'replica-sticky:{user_id}'):
+        return 'default'
+
+    now = time.monotonic()
+    candidates = [i for i in candidates if _unhealthy.get(i, 0) < now]
+    random.shuffle(candidates)
+    checked = getattr(_local, 'checked', set())
+    for alias in candidates:
+        conn = connections[alias]
+        try:
+            # A connection kept from an earlier request may have dropped since, which only a query
+            # shows. It is checked once per request, and replaced if it dropped.
+            if conn.connection is not None and alias not in checked and not conn.is_usable():
+                conn.close()
+            conn.ensure_connection()
+            checked.add(alias)
+            _local.checked = checked
+            return alias
+        except OperationalError:
+            _unhealthy[alias] = now + settings.REPLICA_RETRY_AFTER
+    return 'default'
+
+
+def read_connection(user_id=None):
+    """Connection for read-only queries, see read_alias"""
+
+    return connections[read_alias(user_id)]
+
+
+def fund_connection():
+    """Connection for reading fund data: the local snapshot on nodes which serve from one, else as read_connection"""
+
+    if 'snapshot' in settings.DATABASES:
+        return connections['snapshot']
+    return read_connection()
+
+
+class ReplicaRouter:
+    """Sends ORM reads to the replicas and everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return 'default'
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
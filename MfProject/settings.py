@@ -11,7 +11,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
-from decouple import config
+import tempfile
+from decouple import config, Csv
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -44,13 +45,19 @@ INSTALLED_APPS = [
 
     'funds',
     'portfolio',
+    'jobs',
+    'alerts',
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         # 'rest_framework.authentication.BasicAuthentication',
         # 'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication', 
+        'portfolio.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'MfProject.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
@@ -100,6 +107,94 @@ DATABASES = {
     }
 }
 
+# Read replicas as a comma separated list of host[:port][/name], e.g. for two local databases
+# DB_REPLICAS=localhost/mfdb_replica. Read-only queries go to these through MfProject.routers.
+for number, replica in enumerate(config('DB_REPLICAS', default='', cast=Csv()), 1):
+    host, _, name = replica.partition('/')
+    host, _, port = host.partition(':')
+    DATABASES[f'replica{number}'] = dict(DATABASES['default'], HOST=host,
+                                         PORT=port or DATABASES['default']['PORT'],
+                                         NAME=name or DATABASES['default']['NAME'])
+
+# Path of a fund data snapshot written by manage.py export_snapshot. If set, fund endpoints read
+# from this local SQLite file instead of PostgreSQL, see MfProject.routers.fund_connection
+FUND_SNAPSHOT = config('FUND_SNAPSHOT', default='')
+if FUND_SNAPSHOT:
+    DATABASES['snapshot'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{FUND_SNAPSHOT}?mode=ro',
+    }
+
+DATABASE_ROUTERS = ['MfProject.routers.ReplicaRouter']
+
+# Seconds a user reads from the primary after a write, to see the write despite replication lag
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+# Seconds before retrying a replica which could not be connected to
+REPLICA_RETRY_AFTER = config('REPLICA_RETRY_AFTER', default=30, cast=int)
+
+
+# Token authentication, see portfolio.authentication
+
+# Seconds a worker trusts a token it looked up, and the number of tokens it keeps
+TOKEN_CACHE_TTL = config('TOKEN_CACHE_TTL', default=60, cast=int)
+TOKEN_CACHE_SIZE = config('TOKEN_CACHE_SIZE', default=10000, cast=int)
+# Seconds after which a token expires and the user has to log in again. Tokens don't expire if unset.
+TOKEN_EXPIRY = config('TOKEN_EXPIRY', default=None, cast=lambda i: int(i) if i else None)
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mf-project',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    },
+    # Per-user portfolio data. Shared by all workers on a node, so that a write through any
+    # worker invalidates the entries everywhere.
+    'portfolio': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('PORTFOLIO_CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'mf-project-portfolio')),
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+# Warm the cache in the master process before workers are forked (gunicorn --preload)
+PRELOAD_CACHES = config('PRELOAD_CACHES', default=False, cast=bool)
+PRELOAD_HOT_FUNDS = config('PRELOAD_HOT_FUNDS', default=50, cast=int)
+
+
+# Analytics jobs run by manage.py run_jobs
+
+# Seconds a finished job's result is kept
+JOB_RESULT_TTL = config('JOB_RESULT_TTL', default=60 * 60, cast=int)
+# Seconds after which a running job is assumed to have lost its worker
+JOB_STALE_AFTER = config('JOB_STALE_AFTER', default=60 * 60, cast=int)
+
+# Concurrent identical fund computations share one run, see funds.singleflight
+
+# Coalesce across the processes of a node through the single_flight table, not just within one
+SINGLE_FLIGHT_SHARED = config('SINGLE_FLIGHT_SHARED', default=False, cast=bool)
+# Seconds after which a computation is assumed to have lost its process and is taken over
+SINGLE_FLIGHT_STALE_AFTER = config('SINGLE_FLIGHT_STALE_AFTER', default=60, cast=int)
+# Seconds a shared result is still handed to requests arriving just after it finished
+SINGLE_FLIGHT_RESULT_TTL = config('SINGLE_FLIGHT_RESULT_TTL', default=5, cast=int)
+
+
+# Live holdings stream served under ASGI, see portfolio.live
+
+# Seconds between checks for a new NAV load while users are subscribed
+LIVE_POLL_SECONDS = config('LIVE_POLL_SECONDS', default=60, cast=int)
+# Seconds between keepalive comments on an idle stream, so that proxies keep it open
+LIVE_KEEPALIVE_SECONDS = config('LIVE_KEEPALIVE_SECONDS', default=15, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
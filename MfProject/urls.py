@@ -20,4 +20,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('funds/', include('funds.urls')),
     path('users/', include('portfolio.urls')),
+    path('jobs/', include('jobs.urls')),
+    path('alerts/', include('alerts.urls')),
 ]
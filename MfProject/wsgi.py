@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MfProject.settings')
 
 application = get_wsgi_application()
+
+# With gunicorn --preload this runs once in the master, and forked workers share the warm cache
+from django.conf import settings  # noqa: E402
+
+if settings.PRELOAD_CACHES:
+    from funds.cache import warm_up  # noqa: E402
+    warm_up()
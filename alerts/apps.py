@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class AlertsConfig(AppConfig):
+    name = 'alerts'
+
+    def ready(self):
+        from funds.signals import nav_loaded
+        from .methods import on_nav_loaded
+
+        nav_loaded.connect(on_nav_loaded)
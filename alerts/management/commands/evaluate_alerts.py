@@ -0,0 +1,16 @@
+"""Evaluates the alert rules against the latest NAVs"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from alerts.methods import evaluate_alerts
+
+
+class Command(BaseCommand):
+    help = "Check all active alert rules against the latest NAVs and record the triggered ones"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        events = evaluate_alerts()
+        self.stdout.write(f"Recorded {events} alerts in {time.perf_counter() - started:.1f}s")
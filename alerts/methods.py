@@ -0,0 +1,187 @@
+"""User defined alerts on fund NAVs and portfolios, evaluated in bulk after each NAV load"""
+
+from django.db import connection
+
+from MfProject.lazy import lazy_import
+from MfProject.routers import read_connection, mark_write
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+# Kind: description. Thresholds of fund alerts are in percent, of portfolio alerts in rupees.
+ALERT_KINDS = {
+    'below_high': "NAV is at least threshold % below its 52-week high",
+    'above_low': "NAV is at least threshold % above its 52-week low",
+    'day_fall': "NAV fell at least threshold % from the previous NAV",
+    'day_rise': "NAV rose at least threshold % from the previous NAV",
+    'portfolio_day_loss': "Portfolio value fell by at least threshold rupees from the previous NAVs",
+}
+PORTFOLIO_KINDS = {'portfolio_day_loss'}
+
+# NAVs of every fund some active rule depends on, with the previous NAV and the 52-week range,
+# each found by index seeks on nav_history
+fund_stats_query = """
+    with funds as (
+        select amfi_code from alert_rules where active and amfi_code is not null
+        union
+        select th.amfi_code from transaction_history th
+            where th.user_id in (select user_id from alert_rules where active and kind = 'portfolio_day_loss')
+    )
+    select lnav.amfi_code, lnav.date, lnav.nav::float as nav, prev.nav::float as prev_nav,
+            year.high::float as high, year.low::float as low
+        from funds
+        join latest_nav lnav on lnav.amfi_code = funds.amfi_code
+        left join lateral (
+            select nav from nav_history
+                where amfi_code = funds.amfi_code and date < lnav.date
+                order by date desc limit 1
+        ) prev on true
+        left join lateral (
+            select max(nav) as high, min(nav) as low from nav_history
+                where amfi_code = funds.amfi_code and date > lnav.date - interval '1 year'
+        ) year on true"""
+
+rules_query = "select rule_id, user_id, kind, amfi_code, threshold from alert_rules where active"
+
+holdings_query = """select th.user_id, th.amfi_code, sum(th.units)::float as units
+                    from transaction_history th
+                    where th.user_id in (select user_id from alert_rules where active and kind = 'portfolio_day_loss')
+                    group by th.user_id, th.amfi_code"""
+
+insert_events_query = """insert into alert_events (rule_id, user_id, nav_date, value)
+                        select * from unnest(%s::bigint[], %s::int[], %s::date[], %s::float[])
+                        on conflict (rule_id, nav_date) do nothing"""
+
+
+def fund_changes(stats):
+    """Percent change of each fund against the reference of each fund alert kind, one array per kind"""
+
+    nav = stats['nav'].values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'below_high': (1 - nav / stats['high'].values) * 100,
+            'above_low': (nav / stats['low'].values - 1) * 100,
+            'day_fall': (1 - nav / stats['prev_nav'].values) * 100,
+            'day_rise': (nav / stats['prev_nav'].values - 1) * 100,
+        }
+
+
+def portfolio_losses(stats):
+    """Loss in value of each user's holdings from the previous NAVs, and the date of the latest NAV"""
+
+    holdings = pd.read_sql_query(holdings_query, read_connection())
+    holdings = holdings.merge(stats, left_on='amfi_code', right_index=True)
+    holdings['loss'] = holdings['units'] * (holdings['prev_nav'] - holdings['nav'])
+    return holdings.groupby('user_id').agg(loss=('loss', 'sum'), date=('date', 'max'))
+
+
+def evaluate_alerts():
+    """Check every active rule against the latest NAVs in one vectorized pass and record an event for
+        each rule that triggered. A rule triggers at most once per NAV date. Returns the number of new events.
+        Reads go to a replica, except right after a NAV load in the same process, which reads the primary."""
+
+    rules = pd.read_sql_query(rules_query, read_connection())
+    if rules.empty:
+        return 0
+    stats = pd.read_sql_query(fund_stats_query, read_connection(), index_col='amfi_code')
+
+    kinds = rules['kind'].values
+    funds = stats.index.get_indexer(rules['amfi_code'].fillna(-1).astype(int))
+    changes = fund_changes(stats)
+    values = np.full(len(rules), np.nan)
+    dates = np.full(len(rules), None, dtype=object)
+    for kind, change in changes.items():
+        selected = (kinds == kind) & (funds >= 0)
+        values[selected] = change[funds[selected]]
+        dates[selected] = stats['date'].values[funds[selected]]
+
+    portfolio_rules = np.isin(kinds, list(PORTFOLIO_KINDS))
+    if portfolio_rules.any():
+        losses = portfolio_losses(stats).reindex(rules['user_id'][portfolio_rules])
+        values[portfolio_rules] = losses['loss'].values
+        dates[portfolio_rules] = losses['date'].values
+
+    with np.errstate(invalid='ignore'):
+        triggered = values >= rules['threshold'].values
+    if not triggered.any():
+        return 0
+    events = rules[triggered]
+    with connection.cursor() as cur:
+        cur.execute(insert_events_query, (events['rule_id'].tolist(), events['user_id'].tolist(),
+                                          list(dates[triggered]), values[triggered].tolist()))
+        return cur.rowcount
+
+
+def on_nav_loaded(sender, **kwargs):
+    """Evaluate the alerts against the NAVs just loaded"""
+
+    evaluate_alerts()
+
+
+class UserAlerts:
+    """Alert rules and triggered events of a user"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def rules(self):
+        """All alert rules of the user"""
+
+        query = """select rule_id, kind, amfi_code, threshold, active, created_at
+                    from alert_rules where user_id = %s order by rule_id"""
+        return self._fetch(query, (self.user_id,))
+
+    def create_rule(self, kind=None, threshold=None, amfi_code=None):
+        """Create an alert rule. Fund alerts need an amfi_code, portfolio alerts don't take one."""
+
+        if kind not in ALERT_KINDS:
+            return {'message': f"Provide a kind, one of {', '.join(ALERT_KINDS)}", 'status': 400}
+        if (amfi_code is None) != (kind in PORTFOLIO_KINDS):
+            return {'message': "Fund alerts need an amfi_code, portfolio alerts don't take one", 'status': 400}
+        try:
+            threshold = float(threshold)
+        except (TypeError, ValueError):
+            return {'message': "Provide a numeric threshold", 'status': 400}
+        if amfi_code is not None:
+            if isinstance(amfi_code, bool) or not str(amfi_code).isdigit():
+                return {'message': "Provide a numeric amfi_code", 'status': 400}
+            amfi_code = int(amfi_code)
+            with read_connection().cursor() as cur:
+                cur.execute("select 1 from fund_master where amfi_code = %s", (amfi_code,))
+                if cur.fetchone() is None:
+                    return {'message': "Fund not found", 'status': 404}
+
+        insert_query = """insert into alert_rules (user_id, kind, amfi_code, threshold)
+                            values (%s, %s, %s, %s) returning rule_id"""
+        with connection.cursor() as cur:
+            cur.execute(insert_query, (self.user_id, kind, amfi_code, threshold))
+            rule_id = cur.fetchone()[0]
+        mark_write(self.user_id)
+        return {'message': "Alert created successfully", 'status': 201, 'rule_id': rule_id}
+
+    def delete_rule(self, rule_id):
+        """Delete an alert rule with its events. Returns whether the user had the rule."""
+
+        with connection.cursor() as cur:
+            cur.execute("delete from alert_rules where rule_id = %s and user_id = %s", (rule_id, self.user_id))
+            deleted = cur.rowcount
+        mark_write(self.user_id)
+        return bool(deleted)
+
+    def events(self, limit=100):
+        """The user's most recent triggered alerts"""
+
+        query = """select ae.event_id, ae.rule_id, ar.kind, ar.amfi_code, ar.threshold, ae.nav_date, ae.value,
+                        ae.created_at
+                    from alert_events ae
+                    join alert_rules ar on ar.rule_id = ae.rule_id
+                    where ae.user_id = %s
+                    order by ae.created_at desc, ae.event_id desc
+                    limit %s"""
+        return self._fetch(query, (self.user_id, limit))
+
+    def _fetch(self, query, params):
+        with read_connection(self.user_id).cursor() as cur:
+            cur.execute(query, params)
+            keys = [i[0] for i in cur.description]
+            return [dict(zip(keys, i)) for i in cur.fetchall()]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+CREATE_ALERTS = """
+create table alert_rules (
+    rule_id bigserial primary key,
+    user_id integer not null references auth_user (id) on delete cascade,
+    kind text not null,
+    amfi_code integer,
+    threshold double precision not null,
+    active boolean not null default true,
+    created_at timestamptz not null default now()
+);
+
+create index alert_rules_user_idx on alert_rules (user_id);
+create index alert_rules_active_idx on alert_rules (kind, amfi_code) where active;
+
+create table alert_events (
+    event_id bigserial primary key,
+    rule_id bigint not null references alert_rules (rule_id) on delete cascade,
+    user_id integer not null,
+    nav_date date not null,
+    value double precision not null,
+    created_at timestamptz not null default now(),
+    unique (rule_id, nav_date)
+);
+
+create index alert_events_user_idx on alert_events (user_id, created_at desc);
+"""
+
+
+class Migration(migrations.Migration):
+    """User defined alert rules, and the events recorded when new NAVs trigger them"""
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_ALERTS, "drop table alert_events; drop table alert_rules"),
+    ]
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('', views.AlertRules.as_view()),
+    path('<int:rule_id>', views.alert_rule),
+    path('events', views.alert_events),
+]
@@ -0,0 +1,53 @@
+"""Views to manage alert rules and list triggered alerts"""
+
+import json
+
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .methods import UserAlerts
+
+
+class AlertRules(APIView):
+    """This class allows fetching and creating of alert rules"""
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        """Get alert rules"""
+
+        alerts = UserAlerts(request.user.id)
+        return Response(alerts.rules())
+
+    def post(self, request):
+        """Create an alert rule"""
+
+        body_unicode = request.body.decode('utf-8')
+        body = json.loads(body_unicode)
+        alerts = UserAlerts(request.user.id)
+        created_rule = alerts.create_rule(body.get('kind'), body.get('threshold'), body.get('amfi_code'))
+        status = created_rule.pop('status')
+        return Response(created_rule, status=status)
+
+
+@api_view(['DELETE'])
+@permission_classes([IsAuthenticated])
+def alert_rule(request, rule_id):
+    """Delete an alert rule"""
+
+    alerts = UserAlerts(request.user.id)
+    if not alerts.delete_rule(rule_id):
+        return Response({'message': "Alert not found"}, status=404)
+    return Response(status=204)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def alert_events(request):
+    """Most recent triggered alerts of a user"""
+
+    limit = min(int(request.query_params.get('limit', 100)), 1000)
+    alerts = UserAlerts(request.user.id)
+    return Response(alerts.events(limit))
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class FundsConfig(AppConfig):
     name = 'funds'
+
+    def ready(self):
+        from .cache import reset_nav_version
+        from .rolling import on_nav_loaded
+        from .signals import nav_loaded
+
+        nav_loaded.connect(reset_nav_version)
+        nav_loaded.connect(on_nav_loaded)
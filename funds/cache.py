@@ -0,0 +1,75 @@
+"""Process-wide caches for fund data which only changes when new NAVs are loaded"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from MfProject.routers import read_connection, fund_connection
+
+NAV_VERSION_TTL = 60
+
+# Database alias: (version, time it was checked)
+_nav_versions = {}
+
+
+def nav_version(conn=None):
+    """Date of the latest NAV and id of the latest NAV load, e.g. '2020-07-10.412', in the database of a
+        connection, read_connection() by default. Fund data read through fund_connection() is versioned by
+        passing that. Re-checked at most once every NAV_VERSION_TTL seconds. Cache keys which depend on NAVs
+        include this, so a NAV load invalidates them in bulk, in every process, including a load which only
+        corrected past NAVs."""
+
+    conn = conn or read_connection()
+    now = time.monotonic()
+    version, checked = _nav_versions.get(conn.alias, (None, 0))
+    if version is None or now - checked > NAV_VERSION_TTL:
+        with conn.cursor() as cur:
+            cur.execute("select (select max(date) from latest_nav), (select max(load_id) from nav_loads)")
+            version = '{}.{}'.format(*cur.fetchone())
+        _nav_versions[conn.alias] = (version, now)
+    return version
+
+
+def reset_nav_version(**kwargs):
+    """Makes the next nav_version() call of this process check the database, e.g. right after it loaded
+        new NAVs. Other processes see the new version within NAV_VERSION_TTL seconds."""
+
+    _nav_versions.clear()
+
+
+def cache_key(*parts):
+    """Builds a cache key from its parts"""
+
+    return ':'.join(str(i) for i in parts)
+
+
+def warm_up(hot_funds=None):
+    """Preload fund master data, NAV series of the most held funds and the AMC list.
+        Meant to run in the server's master process before it forks workers,
+        so that the cached data is shared copy-on-write between them."""
+
+    from .methods import MutualFund, fetch_amc_list, fund_info_query, pd
+
+    if hot_funds is None:
+        hot_funds = settings.PRELOAD_HOT_FUNDS
+
+    version = nav_version(fund_connection())
+    funds = pd.read_sql_query(fund_info_query, fund_connection(), index_col='amfi_code')
+    cache.set_many({cache_key('fund-info', code, version): info
+                    for code, info in funds.to_dict(orient='index').items()})
+
+    hot_funds_query = """select amfi_code from transaction_history
+                        group by amfi_code order by count(*) desc limit %s"""
+    with read_connection().cursor() as cur:
+        cur.execute(hot_funds_query, (hot_funds,))
+        hot_codes = [i[0] for i in cur.fetchall()]
+    for amfi_code in hot_codes:
+        MutualFund(amfi_code).nav_history
+
+    fetch_amc_list()
+
+    # Workers must not inherit the master's database sockets
+    connections.close_all()
+    return {'funds': len(funds), 'nav_series': len(hot_codes)}
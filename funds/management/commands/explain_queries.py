@@ -0,0 +1,246 @@
+"""Captures the query plans of the hot paths and reports regressions against a baseline"""
+
+import contextlib
+import datetime
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from funds.cache import reset_nav_version
+from funds.methods import MutualFund, FundAdvanced, fund_search, fetch_amc_list
+from MfProject.routers import mark_write
+from portfolio.methods import UserInfo, UserInvestmentManager, UserPortfolio
+
+# Name: function running a hot path with the sampled fund, benchmark fund and user.
+# Every distinct statement the function runs is explained, keyed by the name and a hash of the SQL, so that
+# a baseline is compared statement by statement however many statements a run happens to make.
+SCENARIOS = {
+    'fund-info': lambda s: MutualFund(s['fund']),
+    'nav-history': lambda s: MutualFund(s['fund']).nav_history,
+    'latest-returns': lambda s: MutualFund(s['fund']).latest_returns(),
+    'sip-returns': lambda s: MutualFund(s['fund']).sip_returns(),
+    'rolling-returns': lambda s: FundAdvanced(s['fund']).rolling_returns(3),
+    'risk-metrics': lambda s: FundAdvanced(s['fund']).risk_metrics(s['benchmark']),
+    'fund-search': lambda s: fund_search('axis bluechip'),
+    'amc-list': lambda s: fetch_amc_list(),
+    'user-info': lambda s: UserInfo(s['user']).info(),
+    'folios': lambda s: UserInfo(s['user'])._fetch_folios(),
+    'banks': lambda s: UserInfo.get_banks.__wrapped__(UserInfo(s['user'])),
+    'transactions': lambda s: UserPortfolio(s['user']).transactions(),
+    'portfolio-analytics': lambda s: UserPortfolio.portfolio_analytics.__wrapped__(UserPortfolio(s['user'])),
+    'simulate-switch': lambda s: UserPortfolio(s['user']).simulate_switch([s['fund'], s['benchmark']]),
+    'add-transaction': lambda s: UserInvestmentManager(s['user']).add_transaction(
+        amfi_code=s['fund'], trx_date=datetime.date.today() - datetime.timedelta(days=30), trx_type='INV',
+        amount=1000),
+}
+
+SCAN_NODES = {'Seq Scan', 'Parallel Seq Scan'}
+
+# Relations too large to scan in a hot path, with nav_history's yearly partitions, nav_history_y<year>
+LARGE_TABLES = ('nav_history', 'transaction_history')
+
+
+def sample(fund=None, benchmark=None, user=None):
+    """Representative parameters: the most held funds and the user with the most transactions"""
+
+    with connection.cursor() as cur:
+        cur.execute("""select amfi_code from transaction_history
+                        group by amfi_code order by count(*) desc limit 2""")
+        held = [i[0] for i in cur.fetchall()]
+        cur.execute("select amfi_code from latest_nav order by amfi_code limit 2")
+        held += [i[0] for i in cur.fetchall()]
+        cur.execute("""select user_id from transaction_history
+                        group by user_id order by count(*) desc limit 1""")
+        users = [i[0] for i in cur.fetchall()]
+    if not held or not (user or users):
+        raise CommandError("The database needs funds with NAVs and a user with transactions")
+    fund = fund or held[0]
+    return {'fund': fund, 'benchmark': benchmark or next((i for i in held if i != fund), fund),
+            'user': user or users[0]}
+
+
+def capture(function, params):
+    """The statements a function runs on each database, as (alias, sql, params), and the error it raised
+        if it failed. Statements are rolled back."""
+
+    statements = []
+    error = None
+
+    def record(execute, sql, sql_params, many, context):
+        if not many and sql.lstrip().split(None, 1)[0].lower() in ('select', 'with', 'insert', 'update', 'delete'):
+            statements.append((context['connection'].alias, sql, sql_params))
+        return execute(sql, sql_params, many, context)
+
+    with contextlib.ExitStack() as stack:
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(record))
+        try:
+            with transaction.atomic():
+                function(params)
+                transaction.set_rollback(True)
+        except Exception as exc:
+            error = exc
+    return statements, error
+
+
+def walk(plan):
+    """A plan node and all nodes under it"""
+
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from walk(child)
+
+
+def misestimate(node):
+    """How many times the planner over or under estimated the rows of a node"""
+
+    ratio = max(node['Plan Rows'], 1) / max(node['Actual Rows'], 1)
+    return max(ratio, 1 / ratio)
+
+
+def large_scans(query):
+    """The relations of LARGE_TABLES, or their partitions, which a statement scans sequentially"""
+
+    return [i for i in query['seq_scans'] if i.startswith(LARGE_TABLES)]
+
+
+def match(queries, baseline):
+    """Pairs of (key, baseline key or None) for a report's statements, and the baseline keys left unmatched.
+        A statement is matched by scenario and SQL, and otherwise with the baseline's unmatched statements of
+        its scenario in the order they ran, so that a changed statement is compared with the one it replaced."""
+
+    matched = {key: key for key in queries if key in baseline}
+    unmatched = [key for key in queries if key not in matched]
+    left = [key for key in baseline if key not in queries]
+    for key in unmatched:
+        scenario = key.rsplit(':', 1)[0]
+        base = next((i for i in left if i.rsplit(':', 1)[0] == scenario), None)
+        if base is not None:
+            left.remove(base)
+        matched[key] = base
+    return [(key, matched[key]) for key in queries], left
+
+
+def sql_hash(sql):
+    return hashlib.sha256(sql.encode()).hexdigest()[:12]
+
+
+def explain(sql, params):
+    """EXPLAIN ANALYZE of a statement, rolled back, summarised with its plan"""
+
+    with transaction.atomic():
+        with connection.cursor() as cur:
+            cur.execute(f"explain (analyze, buffers, format json) {sql}", params)
+            result = cur.fetchone()[0]
+        transaction.set_rollback(True)
+    result = json.loads(result) if isinstance(result, str) else result
+    plan = result[0]['Plan']
+    nodes = list(walk(plan))
+    return {
+        'sql_hash': sql_hash(sql),
+        'sql': ' '.join(sql.split()),
+        'total_cost': plan['Total Cost'],
+        'execution_ms': result[0]['Execution Time'],
+        'planning_ms': result[0]['Planning Time'],
+        'plan_rows': plan['Plan Rows'],
+        'actual_rows': plan['Actual Rows'],
+        'misestimate': max(misestimate(i) for i in nodes),
+        'shared_hit': plan.get('Shared Hit Blocks', 0),
+        'shared_read': plan.get('Shared Read Blocks', 0),
+        'seq_scans': sorted({i['Relation Name'] for i in nodes if i['Node Type'] in SCAN_NODES}),
+        'plan': plan,
+    }
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN ANALYZE the queries of the hot paths and flag new sequential scans and cost regressions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run, of {', '.join(SCENARIOS)}")
+        parser.add_argument('--fund', type=int, help="Fund to use instead of the most held one")
+        parser.add_argument('--benchmark', type=int, help="Benchmark fund for risk metrics and switches")
+        parser.add_argument('--user', type=int, help="User to use instead of the one with most transactions")
+        parser.add_argument('--baseline', help="JSON report to compare against")
+        parser.add_argument('--save', help="Write the report as JSON, e.g. to use as the next baseline")
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help="Fractional increase in estimated cost reported as a regression")
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        # Reads go to the primary, so that every statement is explained where it ran
+        mark_write()
+        params = sample(options['fund'], options['benchmark'], options['user'])
+        self.stdout.write(f"Explaining with {params}")
+
+        report = {'params': params, 'queries': {}}
+        for name in options['scenarios'] or SCENARIOS:
+            # Cached results and the memoized NAV version would hide queries
+            cache.clear()
+            reset_nav_version()
+            statements, error = capture(SCENARIOS[name], params)
+            if error is not None:
+                self.stderr.write(f"{name} failed, explaining the {len(statements)} statements before: {error}")
+            other = [alias for alias, _, _ in statements if alias != connection.alias]
+            if other:
+                self.stderr.write(f"{name}: {len(other)} statements on {', '.join(sorted(set(other)))} not explained")
+            for alias, sql, sql_params in statements:
+                key = f'{name}:{sql_hash(sql)}'
+                if alias != connection.alias or key in report['queries']:
+                    continue
+                try:
+                    report['queries'][key] = explain(sql, sql_params)
+                except Exception as error:
+                    self.stderr.write(f"{key} could not be explained: {error}")
+
+        self.print_report(report)
+        if options['save']:
+            with open(options['save'], 'w') as file:
+                json.dump(report, file, indent=2, default=str)
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            regressions = self.compare(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError(f"{regressions} regressions against {options['baseline']}")
+
+    def print_report(self, report):
+        self.stdout.write(f"{'query':<36}{'cost':>12}{'ms':>10}{'rows':>9}{'est x':>8}{'read':>8}  seq scans")
+        for name, query in report['queries'].items():
+            self.stdout.write(f"{name:<36}{query['total_cost']:>12.1f}{query['execution_ms']:>10.2f}"
+                              f"{query['actual_rows']:>9}{query['misestimate']:>8.1f}{query['shared_read']:>8}"
+                              f"  {', '.join(query['seq_scans'])}")
+
+    def compare(self, report, baseline, tolerance):
+        """Print the changes against a baseline report and return the number of regressions.
+            A statement with no baseline to compare with regresses if it scans a large table sequentially."""
+
+        regressions = 0
+        pairs, gone = match(report['queries'], baseline['queries'])
+        self.stdout.write(f"\n{'query':<36}{'cost change':>13}{'ms change':>11}  notes")
+        for name, base_name in pairs:
+            query = report['queries'][name]
+            if base_name is None:
+                scans = large_scans(query)
+                line = f"{name:<36}{'new':>13}{'':>11}  {'seq scan on ' + ', '.join(scans) if scans else ''}"
+                regressions += bool(scans)
+                self.stdout.write(self.style.ERROR(line) if scans else line)
+                continue
+            base = baseline['queries'][base_name]
+            cost_change = query['total_cost'] / base['total_cost'] - 1 if base['total_cost'] else 0
+            time_change = query['execution_ms'] / base['execution_ms'] - 1 if base['execution_ms'] else 0
+            new_scans = sorted(set(query['seq_scans']) - set(base['seq_scans']))
+            notes = [f"changed from {base_name}"] if base_name != name else []
+            notes += [f"new seq scan on {', '.join(new_scans)}"] if new_scans else []
+            regressed = bool(new_scans) or cost_change > tolerance
+            regressions += regressed
+            line = f"{name:<36}{cost_change:>+13.1%}{time_change:>+11.1%}  {'; '.join(notes)}"
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+        for name in gone:
+            self.stdout.write(f"{name:<36}{'gone':>13}")
+        return regressions
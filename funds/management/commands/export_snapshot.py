@@ -0,0 +1,109 @@
+"""Writes a read-only SQLite snapshot of the fund tables, for nodes serving fund endpoints locally"""
+
+import datetime
+import decimal
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from MfProject.routers import read_alias
+
+# SQLite types of the PostgreSQL types of copied columns, by type oid. Other types are stored as text.
+SQLITE_TYPES = {16: 'integer', 20: 'integer', 21: 'integer', 23: 'integer', 700: 'real', 701: 'real',
+                1700: 'real', 1082: 'date'}
+# Full text vectors are replaced by the snapshot's own FTS5 index
+SKIPPED_TYPES = {3614}
+
+# Table: (query, primary key of tables stored clustered on it)
+TABLES = {
+    'amc_master': ("select * from amc_master", None),
+    'fund_master': ("select * from fund_master", None),
+    'latest_nav': ("select * from latest_nav", None),
+    'nav_loads': ("select load_id from nav_loads", None),
+    'nav_history': ("select amfi_code, date, nav from nav_history order by amfi_code, date", 'amfi_code, date'),
+}
+
+SNAPSHOT_INDEXES = [
+    "create index amc_master_amc_id_idx on amc_master (amc_id)",
+    "create index fund_master_amfi_code_idx on fund_master (amfi_code)",
+    "create index latest_nav_amfi_code_idx on latest_nav (amfi_code)",
+    "create virtual table fund_search using fts5(fund_name, amfi_code unindexed)",
+    "insert into fund_search (fund_name, amfi_code) select fund_name, amfi_code from latest_nav",
+    "analyze",
+]
+
+
+def sqlite_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def copy_table(source, target, name, query, primary_key, chunk_size):
+    """Copy the rows of a query into a new table, reading them through a server side cursor.
+        Returns the number of rows."""
+
+    count = 0
+    with source.chunked_cursor() as cur:
+        cur.execute(query)
+        rows = cur.fetchmany(chunk_size)
+        # A server side cursor only has a description after the first fetch
+        kept = [i for i, column in enumerate(cur.description) if column.type_code not in SKIPPED_TYPES]
+        columns = [f'"{cur.description[i].name}" {SQLITE_TYPES.get(cur.description[i].type_code, "text")}'
+                   for i in kept]
+        if primary_key is not None:
+            target.execute(f"create table {name} ({', '.join(columns)}, primary key ({primary_key})) without rowid")
+        else:
+            target.execute(f"create table {name} ({', '.join(columns)})")
+
+        insert = f"insert into {name} values ({', '.join(['?'] * len(kept))})"
+        while rows:
+            target.executemany(insert, [[sqlite_value(row[i]) for i in kept] for row in rows])
+            count += len(rows)
+            rows = cur.fetchmany(chunk_size)
+    return count
+
+
+class Command(BaseCommand):
+    help = "Export fund_master, amc_master, latest_nav, nav_loads and nav_history to an indexed SQLite snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="Snapshot file, FUND_SNAPSHOT by default")
+        parser.add_argument('--chunk-size', type=int, default=50000, help="Rows read and written at a time")
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.FUND_SNAPSHOT
+        if not path:
+            raise CommandError("Provide a path or set FUND_SNAPSHOT")
+
+        # Built next to the snapshot and moved over it, so that readers never see a partial file
+        building = f'{path}.building'
+        if os.path.exists(building):
+            os.remove(building)
+        target = sqlite3.connect(building)
+        target.execute("pragma journal_mode = off")
+        target.execute("pragma synchronous = off")
+
+        started = time.perf_counter()
+        source = connections[read_alias()]
+        # One repeatable read transaction, so that all tables are copied as of the same moment
+        with transaction.atomic(using=source.alias):
+            with source.cursor() as cur:
+                cur.execute("set transaction isolation level repeatable read, read only")
+            for name, (query, primary_key) in TABLES.items():
+                count = copy_table(source, target, name, query, primary_key, options['chunk_size'])
+                self.stdout.write(f"{name}: {count} rows")
+
+        for statement in SNAPSHOT_INDEXES:
+            target.execute(statement)
+        target.commit()
+        target.execute("vacuum")
+        target.close()
+        os.replace(building, path)
+        self.stdout.write(f"Wrote {path} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,106 @@
+"""Loads NAVs in the AMFI NAV report format into nav_history and latest_nav"""
+
+import datetime
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from funds.partitions import ensure_nav_partitions
+from funds.signals import nav_loaded
+from MfProject.routers import mark_write
+
+corrections_query = """
+    select nh.amfi_code, min(nh.date)
+        from unnest(%(codes)s::int[], %(dates)s::date[], %(navs)s::float[]) as n(amfi_code, date, nav)
+        join nav_history nh on nh.amfi_code = n.amfi_code and nh.date = n.date
+        where nh.date between %(low)s and %(high)s and nh.nav is distinct from n.nav
+        group by nh.amfi_code
+    """
+
+upsert_query = """
+    insert into nav_history (amfi_code, date, nav)
+        select * from unnest(%(codes)s::int[], %(dates)s::date[], %(navs)s::float[])
+        on conflict (amfi_code, date) do update set nav = excluded.nav
+        where nav_history.nav is distinct from excluded.nav
+    """
+
+latest_nav_query = """
+    update latest_nav lnav set date = n.date, nav = n.nav
+        from (
+            select distinct on (amfi_code) *
+                from unnest(%(codes)s::int[], %(dates)s::date[], %(navs)s::float[]) as t(amfi_code, date, nav)
+                order by amfi_code, date desc
+        ) n
+        where lnav.amfi_code = n.amfi_code and n.date >= lnav.date
+    """
+
+
+def parse_navs(lines):
+    """Parse the semicolon separated AMFI report, which has section headings between the rows"""
+
+    header = None
+    navs = {}
+    for line in lines:
+        fields = [i.strip() for i in line.split(';')]
+        if header is None:
+            if 'Scheme Code' in fields:
+                header = fields
+                code_col, nav_col, date_col = (header.index(i) for i in ('Scheme Code', 'Net Asset Value', 'Date'))
+            continue
+        if len(fields) != len(header):
+            continue
+        try:
+            date = datetime.datetime.strptime(fields[date_col], '%d-%b-%Y').date()
+            navs[(int(fields[code_col]), date)] = float(fields[nav_col])
+        except ValueError:
+            continue
+    if header is None:
+        raise CommandError("Not an AMFI NAV report: no header line found")
+    return navs
+
+
+class Command(BaseCommand):
+    help = "Load NAVs from an AMFI NAV report file or URL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Path or URL of the NAV report")
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if source.startswith(('http://', 'https://')):
+            with urllib.request.urlopen(source) as response:
+                lines = response.read().decode('utf-8', errors='replace').splitlines()
+        else:
+            with open(source, encoding='utf-8', errors='replace') as file:
+                lines = file.read().splitlines()
+
+        navs = parse_navs(lines)
+        if not navs:
+            self.stdout.write("No NAVs found")
+            return
+
+        codes, dates = zip(*navs)
+        params = {'codes': list(codes), 'dates': list(dates), 'navs': list(navs.values()),
+                  'low': min(dates), 'high': max(dates)}
+
+        with transaction.atomic():
+            created = ensure_nav_partitions(i.year for i in dates)
+            with connection.cursor() as cur:
+                cur.execute(corrections_query, params)
+                corrected = dict(cur.fetchall())
+                cur.execute(upsert_query, params)
+                changed = cur.rowcount
+                cur.execute(latest_nav_query, params)
+                if changed:
+                    # A new NAV version, for every process, even if only historical NAVs were corrected
+                    cur.execute("insert into nav_loads (funds, corrected) values (%s, %s)",
+                                (len(set(codes)), len(corrected)))
+
+        # Handlers read the NAVs just loaded, which the replicas may not have yet
+        mark_write()
+        nav_loaded.send(sender=self.__class__, amfi_codes=sorted(set(codes)), corrected=corrected)
+
+        if created:
+            self.stdout.write(f"Created partitions {', '.join(created)}")
+        self.stdout.write(f"Loaded {len(navs)} NAVs for {len(set(codes))} funds, corrected {len(corrected)} funds")
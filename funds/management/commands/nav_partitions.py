@@ -0,0 +1,25 @@
+"""Lists and creates the yearly partitions of nav_history"""
+
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from funds.partitions import nav_partitions, ensure_nav_partitions
+
+
+class Command(BaseCommand):
+    help = "List the nav_history partitions, and create missing ones for the coming years"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--create', type=int, nargs='*', default=[], help="Years to create partitions for")
+        parser.add_argument('--ahead', type=int, default=0, help="Create partitions for this many years ahead")
+
+    def handle(self, *args, **options):
+        years = list(options['create'])
+        if options['ahead']:
+            this_year = datetime.date.today().year
+            years += [this_year + i for i in range(options['ahead'] + 1)]
+        for name in ensure_nav_partitions(years):
+            self.stdout.write(f"Created {name}")
+        for name, bounds in nav_partitions():
+            self.stdout.write(f"{name}: {bounds}")
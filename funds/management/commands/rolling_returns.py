@@ -0,0 +1,22 @@
+"""Builds and extends the persisted rolling return series"""
+
+from django.core.management.base import BaseCommand
+
+from funds.rolling import rebuild_rolling_returns, extend_rolling_returns
+
+
+class Command(BaseCommand):
+    help = "Rebuild the rolling return series of some funds, or extend all stored series with new NAVs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('amfi_codes', nargs='*', type=int, help="Funds to rebuild the series of")
+        parser.add_argument('--periods', nargs='+', type=int, default=[1, 3, 5], help="Periods in years")
+
+    def handle(self, *args, **options):
+        if not options['amfi_codes']:
+            self.stdout.write(f"Appended {extend_rolling_returns()} points")
+            return
+        for amfi_code in options['amfi_codes']:
+            for period in options['periods']:
+                rebuild_rolling_returns(amfi_code, period)
+        self.stdout.write(f"Rebuilt {len(options['amfi_codes']) * len(options['periods'])} series")
@@ -0,0 +1,66 @@
+"""Reports cold start time and first-request latency of the project"""
+
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter so that nothing is imported or cached beforehand
+PROBE = """
+import json, os, sys, time, types
+
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MfProject.settings')
+from MfProject.wsgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+ready = time.perf_counter()
+
+report = {
+    'startup': ready - start,
+    # Deferred modules stay in sys.modules as lazy stubs until first used
+    'heavy_modules_loaded': [i for i in ('pandas', 'numpy') if type(sys.modules.get(i)) is types.ModuleType],
+    'requests': [],
+}
+
+from django.test import Client
+client = Client(raise_request_exception=False)
+for path in sys.argv[1:]:
+    timings = []
+    for _ in range(2):
+        tic = time.perf_counter()
+        status = client.get(path).status_code
+        timings.append(time.perf_counter() - tic)
+    report['requests'].append({'path': path, 'status': status, 'first': timings[0], 'second': timings[1]})
+print(json.dumps(report))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measures startup time and first-request latency in a fresh process"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['/users/login/', '/funds/amc-list'])
+        parser.add_argument('--runs', type=int, default=3, help="Number of cold starts to average over")
+        parser.add_argument('--preload', action='store_true', help="Warm the caches at startup, as in production")
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, PRELOAD_CACHES=str(options['preload']))
+        reports = []
+        for _ in range(options['runs']):
+            result = subprocess.run([sys.executable, '-c', PROBE] + options['paths'], cwd=settings.BASE_DIR,
+                                    env=env, stdout=subprocess.PIPE, check=True)
+            reports.append(json.loads(result.stdout.decode().strip().splitlines()[-1]))
+
+        runs = len(reports)
+        startup = sum(i['startup'] for i in reports) / runs
+        self.stdout.write(f"Startup: {startup * 1000:.1f} ms (average of {runs} runs)")
+        self.stdout.write(f"Heavy modules loaded at startup: {', '.join(reports[-1]['heavy_modules_loaded']) or 'none'}")
+        for i, request in enumerate(reports[-1]['requests']):
+            first = sum(j['requests'][i]['first'] for j in reports) / runs
+            second = sum(j['requests'][i]['second'] for j in reports) / runs
+            self.stdout.write(f"{request['path']} [{request['status']}]: "
+                              f"first {first * 1000:.1f} ms, warm {second * 1000:.1f} ms")
@@ -1,118 +1,112 @@
 """This module defines functions for analysing funds"""
 
 import datetime
-from dateutil.relativedelta import relativedelta
+import json
+import re
 
-import pandas as pd
-import numpy as np
+from django.core.cache import cache
 
-from django.db import connection
+from MfProject.lazy import lazy_import
+from MfProject.routers import read_connection, fund_connection
+from .cache import nav_version, cache_key
+from .utils import xirr_np, risk_metrics
 
-from .utils import xirr_np
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+relativedelta = lazy_import('dateutil.relativedelta')
 
-
-class MutualFund:
-    """defines a class for a specific mutual fund"""
-
-    query = """select fm.fund_name, fm.amc, fm.fund_plan, fm.option, fm.primary_fund_name,
+fund_info_query = """select fm.amfi_code, fm.fund_name, fm.amc, fm.fund_plan, fm.option, fm.primary_fund_name,
             fm.primary_fund_code, fm.category, fm.sub_category, fm.amc_id, lnav.nav
             from fund_master fm
             join latest_nav lnav on fm.amfi_code = lnav.amfi_code
-            where fm.amfi_code = %s
             """
 
+# Days an as-of lookup searches back (or forward) for a NAV, spanning holidays and missed publications
+NAV_AS_OF_WINDOW = 31
+
+
+class MutualFund:
+    """defines a class for a specific mutual fund"""
+
+    query = fund_info_query + "where fm.amfi_code = %s"
+
     nav_query = """select amfi_code, date, nav from nav_history
                     where amfi_code = %s order by date"""
 
     def __init__(self, amfi_code):
         self.amfi_code = amfi_code
-        result = pd.read_sql_query(self.query, connection, params=[amfi_code])
-        self.info = result.to_dict(orient='records')[0]
+        key = cache_key('fund-info', amfi_code, nav_version(fund_connection()))
+        info = cache.get(key)
+        if info is None:
+            result = pd.read_sql_query(self.query, fund_connection(), params=[amfi_code])
+            info = result.drop(columns='amfi_code').to_dict(orient='records')[0]
+            cache.set(key, info)
+        self.info = dict(info)
         for key, value in self.info.items():
             setattr(self, key, value)
         self.nav_hist = None
-        self.rr = None
+        self.rr = {}
 
     @property
     def nav_history(self):
         """Fetch the nav history of the fund after checking for cached values"""
 
         if self.nav_hist is None:
-            self.nav_hist = pd.read_sql_query(self.nav_query, connection, params=[self.amfi_code],
-                                              index_col='date', parse_dates='date')
+            key = cache_key('nav-history', self.amfi_code, nav_version(fund_connection()))
+            self.nav_hist = cache.get(key)
+            if self.nav_hist is None:
+                self.nav_hist = pd.read_sql_query(self.nav_query, fund_connection(), params=[self.amfi_code],
+                                                  index_col='date', parse_dates='date')
+                cache.set(key, self.nav_hist)
         return self.nav_hist
 
     def latest_returns(self):
         """Fetches the latest 1-3-5 year returns for funds"""
 
-        query = """
-            select amfi_code, date, nav
-                from nav_history nh
-                where amfi_code = %s and date > current_date - '61 month'::interval
-                and extract(month from date) between extract(month from current_date)-1 and extract(month from current_date)
-                order by date
-            """
-        with connection.cursor() as cur:
-            cur.execute(query, (self.amfi_code,))
-            result = cur.fetchall()
-
-        result = np.array(result)
-
-        dates = [datetime.date.today(),
-                 datetime.date.today() - relativedelta(years=1),
-                 datetime.date.today() - relativedelta(years=3),
-                 datetime.date.today() - relativedelta(years=5)]
-        data = [result[result[:, 1] <= i][-1] for i in dates]
+        today = datetime.date.today()
+        dates = [today] + [today - relativedelta.relativedelta(years=i) for i in (1, 3, 5)]
+        data = nav_as_of([(self.amfi_code, i) for i in dates], conn=fund_connection())
 
+        latest_date, latest_nav = data[0][2:]
+        if latest_nav is None:
+            return []
         returns = []
-        for i, j in enumerate(data):
-            if i > 0:
-                year = (j[1]-data[0][1]).days/-365
-                returns.append({'year': int(round(year, 0)), 'return': (data[0][2]/j[2])**(1/year)-1})
+        for _, _, date, nav in data[1:]:
+            if nav is None:
+                continue
+            year = (date-latest_date).days/-365
+            returns.append({'year': int(round(year, 0)), 'return': (latest_nav/nav)**(1/year)-1})
 
         return returns
 
+    def sip_schedule(self, months, day=10):
+        """Dates and NAVs of a monthly SIP on the first NAV date on or after the given day of the month"""
+
+        today = datetime.date.today()
+        anchor = today.replace(day=day) - datetime.timedelta(days=1)
+        anchors = [anchor - relativedelta.relativedelta(months=i) for i in range(months, -1, -1)]
+        result = nav_as_of([(self.amfi_code, i) for i in anchors], after=True, conn=fund_connection())
+
+        # An installment falls in the anchor's own month, otherwise that month is skipped
+        return [(date, nav) for _, as_of, date, nav in result
+                if date is not None and (date.year, date.month) == (as_of.year, as_of.month)]
+
     def sip_returns(self):
         """Fetches the latest 1-3-5 year SIP returns for funds"""
 
-        sip_schedule_query = """
-            with myvars(xamfi_code, xmonths) as (
-                values(%s, %s)
-            )
-            select amfi_code, date, nav, 10000 as amount, round(10000/nav::numeric, 3) as units
-                from(
-                    select *, row_number() over (partition by xmonth order by date) as rn,
-                        row_number() over (order by date) as rno
-                        from (
-                            select *, TO_CHAR(date, 'YYYY-MM') as xMonth
-                                from nav_history, myvars where amfi_code = xamfi_code
-                                and extract(day from date) >= 10
-                                and date between current_date - (xmonths || ' month')::interval and current_date
-                        ) t1
-                    ) t2
-                    where rn = 1 and rno <> 1
-            union
-            select amfi_code, date, nav, 0 as amount, 0 as units
-                from latest_nav, myvars
-                where amfi_code = xamfi_code
-            order by date
-            """
         months = [60, 36, 12]
         xirrs = []
 
-        with connection.cursor() as cur:
-            cur.execute(sip_schedule_query, (self.amfi_code, months[0]+1))
-            transactions = cur.fetchall()
-        transactions = np.array(transactions)
-        transactions[:, 3] = transactions[:, 3].astype(float)
-        transactions[:, 4] = transactions[:, 4].astype(float)
+        schedule = self.sip_schedule(months[0])
+        with fund_connection().cursor() as cur:
+            cur.execute("select date, nav from latest_nav where amfi_code = %s", (self.amfi_code,))
+            latest_date, latest_nav = cur.fetchone()
 
         for month in months:
-            df_slice = transactions[-(month+1):, :]
-            sip_value = sum(df_slice[:-1, 4])*df_slice[-1, 2]
-            df_slice[-1, 3] = sip_value * -1
-            dates = df_slice[:, 1]
-            amounts = df_slice[:, 3]
+            installments = schedule[-month:]
+            units = sum(round(10000/nav, 3) for _, nav in installments)
+            dates = np.array([i[0] for i in installments] + [latest_date])
+            amounts = np.array([10000.0] * len(installments) + [units * latest_nav * -1])
             xirrs.append({'years': month // 12, 'returns': round(xirr_np(dates, amounts), 6)})
 
         return xirrs
@@ -146,31 +140,147 @@ class FundAdvanced(MutualFund):
         }
         return rolling_summary
 
+    def risk_metrics(self, benchmark=None, risk_free_rate=0.06, start_date=None, end_date=None):
+        """Volatility, Sharpe, Sortino, max drawdown and, against a benchmark fund, beta, tracking error
+            and downside capture"""
+
+        return bulk_risk_metrics([self.amfi_code], benchmark, risk_free_rate, start_date, end_date)[self.amfi_code]
+
     def rolling_returns(self, period=1, start_date=None, end_date=None):
-        if self.rr is None:
-            self.rr = self._rolling_returns(period=period, start_date=start_date, end_date=end_date)
-        return self.rr
-
-    def _rolling_returns(self, period=1, start_date=None, end_date=None):
-        query = """
-                select t1.*, nh.amfi_code, nh."date", nh.nav, nh2.date as old_date, nh2.nav as old_nav
-                from (
-                    SELECT dd::date as gen_date
-                        FROM generate_series('2005-01-01'::timestamp, current_date::timestamp, '1 day'::interval) dd
-                    )  t1
-                left join nav_history nh on t1.gen_date = nh.date and nh.amfi_code = %(amfi_code)s
-                left join nav_history nh2 on t1.gen_date - %(duration)s::interval = nh2.date and nh2.amfi_code = nh.amfi_code
-                order by t1.gen_date
-                """
-        duration = str(period) + ' year'
-        rr_nav = pd.read_sql(query, connection, params={'amfi_code': self.amfi_code, 'duration': duration})
-        rr_nav['old_nav'] = rr_nav['old_nav'].ffill()
-        rr_nav['growth'] = rr_nav['nav'] / rr_nav['old_nav'] - 1
-        return rr_nav[['date', 'growth']].dropna().reset_index(drop=True)
+        """Rolling returns for the period, read from the persisted series for the date window"""
+
+        from .rolling import read_rolling_returns
+
+        key = (period, start_date, end_date)
+        if key not in self.rr:
+            self.rr[key] = read_rolling_returns(self.amfi_code, period, start_date, end_date)
+        return self.rr[key]
+
+
+def nav_as_of(pairs, after=False, window=NAV_AS_OF_WINDOW, conn=None):
+    """Resolves the NAV for many (amfi_code, date) pairs in a single query.
+        Each pair is one index seek on nav_history(amfi_code, date), returning the last NAV on or before
+        the date, or the first NAV strictly after it if after is True.
+        Only NAVs within window days of the date are considered, which also bounds the query to the
+        nav_history partitions that can hold them. Pass window=None to search the whole history.
+        Reads through conn, read_connection() by default. Fund endpoints pass fund_connection(), which may be
+        a snapshot up to a day old, so transactions and other live data must not.
+        Returns (amfi_code, as_of, date, nav) rows in the order of pairs, with None for missing NAVs."""
+
+    if not pairs:
+        return []
+
+    codes, dates = zip(*pairs)
+    dates = [datetime.date.fromisoformat(i) if isinstance(i, str) else i for i in dates]
+    conn = conn or read_connection()
+    if conn.vendor == 'sqlite':
+        return _nav_as_of_sqlite(conn, codes, dates, after, window)
+    params = {'codes': list(codes), 'dates': dates, 'window': window}
+
+    if after:
+        condition, order = 'date > q.as_of', 'date'
+        window_condition = 'and date <= q.as_of + %(window)s and date between %(low)s and %(high)s'
+        params['low'], params['high'] = min(dates), max(dates) + datetime.timedelta(days=window or 0)
+    else:
+        condition, order = 'date <= q.as_of', 'date desc'
+        window_condition = 'and date >= q.as_of - %(window)s and date between %(low)s and %(high)s'
+        params['low'], params['high'] = min(dates) - datetime.timedelta(days=window or 0), max(dates)
+
+    query = f"""
+        select q.amfi_code, q.as_of, nh.date, nh.nav
+            from unnest(%(codes)s::int[], %(dates)s::date[]) with ordinality as q(amfi_code, as_of, ord)
+            left join lateral (
+                select date, nav from nav_history
+                    where amfi_code = q.amfi_code and {condition}
+                    {window_condition if window is not None else ''}
+                    order by {order} limit 1
+            ) nh on true
+            order by q.ord
+        """
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return cur.fetchall()
+
+
+def _nav_as_of_sqlite(conn, codes, dates, after, window):
+    """nav_as_of on a SQLite snapshot, with the pairs passed as JSON and one correlated index seek each"""
+
+    if after:
+        condition, order, bound = 'date > q.as_of', 'date', f"date <= date(q.as_of, '+{int(window or 0)} days')"
+    else:
+        condition, order, bound = 'date <= q.as_of', 'date desc', f"date >= date(q.as_of, '-{int(window or 0)} days')"
+    query = f"""
+        select q.amfi_code, q.as_of as "as_of [date]", nh.date as "date [date]", nh.nav
+            from (
+                select p.key as ord, json_extract(p.value, '$[0]') as amfi_code, json_extract(p.value, '$[1]') as as_of
+                    from json_each(%s) p
+            ) q
+            left join nav_history nh on nh.amfi_code = q.amfi_code and nh.date = (
+                select date from nav_history
+                    where amfi_code = q.amfi_code and {condition}
+                    {'and ' + bound if window is not None else ''}
+                    order by {order} limit 1
+            )
+            order by q.ord
+        """
+    pairs = json.dumps([[int(code), date.isoformat()] for code, date in zip(codes, dates)])
+    with conn.cursor() as cur:
+        cur.execute(query, [pairs])
+        return cur.fetchall()
+
+
+def nav_frame(amfi_codes, start_date=None, end_date=None):
+    """NAV history of many funds in one query, with dates as index and one column per fund"""
+
+    codes = [int(i) for i in amfi_codes]
+    query = f"select amfi_code, date, nav from nav_history where amfi_code in ({', '.join(['%s'] * len(codes))})"
+    params = codes
+    if start_date is not None:
+        query += " and date >= %s"
+        params.append(start_date)
+    if end_date is not None:
+        query += " and date <= %s"
+        params.append(end_date)
+    navs = pd.read_sql_query(query, fund_connection(), params=params, parse_dates='date')
+    return navs.pivot(index='date', columns='amfi_code', values='nav').sort_index()
+
+
+def bulk_risk_metrics(amfi_codes, benchmark=None, risk_free_rate=0.06, start_date=None, end_date=None,
+                      chunk_size=500):
+    """Risk metrics for many funds, computed a chunk of funds at a time and cached until the next NAV load.
+        Raises ValueError if the benchmark has no NAVs in the period."""
+
+    version = nav_version(fund_connection())
+    keys = {code: cache_key('risk-metrics', code, benchmark, risk_free_rate, start_date, end_date, version)
+            for code in amfi_codes}
+    cached = cache.get_many(keys.values())
+    pending = [code for code, key in keys.items() if key not in cached]
+
+    bench_navs = None
+    if benchmark is not None and pending:
+        bench_navs = nav_frame([benchmark], start_date, end_date)
+        if int(benchmark) not in bench_navs:
+            raise ValueError(f"No NAVs of benchmark {benchmark} in the period")
+        bench_navs = bench_navs[int(benchmark)]
+
+    for i in range(0, len(pending), chunk_size):
+        metrics = risk_metrics(nav_frame(pending[i:i+chunk_size], start_date, end_date), bench_navs, risk_free_rate)
+        for column in ('peak_date', 'trough_date', 'recovery_date'):
+            metrics[column] = pd.to_datetime(metrics[column]).dt.date
+        metrics = metrics.astype(object).where(metrics.notna(), None)
+        computed = {keys[code]: record for code, record in metrics.to_dict(orient='index').items()}
+        cache.set_many(computed)
+        cached.update(computed)
+
+    return {code: cached.get(key) for code, key in keys.items()}
 
 
 def fund_search(search_string, plan='%', option='%'):
-    """Search funds using PostgreSQL TS Query"""
+    """Search funds using PostgreSQL TS Query, or the full text index of a SQLite snapshot"""
+
+    conn = fund_connection()
+    if conn.vendor == 'sqlite':
+        return _fund_search_sqlite(conn, search_string, plan, option)
 
     fund_name = search_string.replace(" ", "%").replace("%-", " & !")
     fund_name = fund_name.replace('cap', '%cap').replace('fund', '')
@@ -180,16 +290,36 @@ def fund_search(search_string, plan='%', option='%'):
                     where lnav.fts_doc @@ to_tsquery(%s)
                     and fm.fund_plan ilike %s and fm.option ilike %s order by lnav.fund_name
                 """
-    results = pd.read_sql_query(sql_query, connection, params=[fund_name, plan, option])
+    results = pd.read_sql_query(sql_query, conn, params=[fund_name, plan, option])
     return results
 
 
-def fetch_amc_list():
-    """Fetch the entire list of AMCs"""
+def _fund_search_sqlite(conn, search_string, plan, option):
+    """fund_search on the FTS5 index of a snapshot. Words match as prefixes and words starting with - exclude."""
+
+    words = [(i.startswith('-'), re.sub(r'\W', '', i)) for i in search_string.lower().split()]
+    included = [f'"{word}"*' for excluded, word in words if word and word != 'fund' and not excluded]
+    if not included:
+        return pd.DataFrame()
+    match = ' '.join(included) + ''.join(f' NOT "{word}"*' for excluded, word in words if word and excluded)
+    sql_query = """select lnav.*, fm.sub_category from fund_search fs
+                    join latest_nav lnav on fs.amfi_code = lnav.amfi_code
+                    join fund_master fm on lnav.amfi_code = fm.amfi_code
+                    where fund_search match %s
+                    and fm.fund_plan like %s and fm.option like %s order by lnav.fund_name
+                """
+    return pd.read_sql_query(sql_query, conn, params=[match, plan, option])
 
-    with connection.cursor() as cur:
-        cur.execute("select * from amc_master")
-        amcs = cur.fetchall()
-        keys = [i[0] for i in cur.description]
 
-    return [dict(zip(keys, i)) for i in amcs]
+def fetch_amc_list():
+    """Fetch the entire list of AMCs, cached until the next NAV load like the rest of the fund data"""
+
+    key = cache_key('amc-list', nav_version(fund_connection()))
+    amcs = cache.get(key)
+    if amcs is None:
+        with fund_connection().cursor() as cur:
+            cur.execute("select * from amc_master")
+            keys = [i[0] for i in cur.description]
+            amcs = [dict(zip(keys, i)) for i in cur.fetchall()]
+        cache.set(key, amcs)
+    return amcs
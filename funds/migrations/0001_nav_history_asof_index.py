@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Covering index for as-of NAV lookups, so each lookup is a single index-only seek"""
+
+    atomic = False
+
+    dependencies = []
+
+    operations = [
+        migrations.RunSQL(
+            "create index concurrently if not exists nav_history_amfi_code_date_idx "
+            "on nav_history (amfi_code, date) include (nav)",
+            "drop index concurrently if exists nav_history_amfi_code_date_idx",
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations
+
+PARTITION_NAV_HISTORY = """
+alter table nav_history rename to nav_history_unpartitioned;
+
+create table nav_history (like nav_history_unpartitioned including defaults) partition by range (date);
+
+do $$
+declare
+    year int;
+begin
+    for year in
+        select generate_series(coalesce(min(extract(year from date))::int, extract(year from current_date)::int),
+                               extract(year from current_date)::int + 1)
+            from nav_history_unpartitioned
+    loop
+        execute format('create table nav_history_y%s partition of nav_history for values from (%L) to (%L)',
+                       year, make_date(year, 1, 1), make_date(year + 1, 1, 1));
+    end loop;
+end $$;
+
+insert into nav_history
+    select distinct on (amfi_code, date) * from nav_history_unpartitioned order by amfi_code, date;
+
+drop table nav_history_unpartitioned;
+
+create unique index nav_history_amfi_code_date_idx on nav_history (amfi_code, date) include (nav);
+create index nav_history_date_brin on nav_history using brin (date);
+"""
+
+UNPARTITION_NAV_HISTORY = """
+create table nav_history_unpartitioned as select * from nav_history;
+drop table nav_history;
+alter table nav_history_unpartitioned rename to nav_history;
+create index nav_history_amfi_code_date_idx on nav_history (amfi_code, date) include (nav);
+"""
+
+
+class Migration(migrations.Migration):
+    """Range partitions nav_history by year, with a BRIN index on date and a btree on (amfi_code, date)"""
+
+    dependencies = [
+        ('funds', '0001_nav_history_asof_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_NAV_HISTORY, UNPARTITION_NAV_HISTORY),
+    ]
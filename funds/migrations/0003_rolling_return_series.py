@@ -0,0 +1,23 @@
+from django.db import migrations
+
+CREATE_SERIES = """
+create table rolling_return_series (
+    amfi_code integer not null,
+    period integer not null,
+    date date not null,
+    growth double precision not null,
+    primary key (amfi_code, period, date)
+);
+"""
+
+
+class Migration(migrations.Migration):
+    """Persisted rolling returns per fund and period, extended as new NAVs are loaded"""
+
+    dependencies = [
+        ('funds', '0002_partition_nav_history'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SERIES, "drop table rolling_return_series"),
+    ]
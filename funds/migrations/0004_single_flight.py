@@ -0,0 +1,22 @@
+from django.db import migrations
+
+CREATE_SINGLE_FLIGHT = """
+create table single_flight (
+    flight_key text primary key,
+    started_at timestamp with time zone not null default now(),
+    finished_at timestamp with time zone,
+    result text
+);
+"""
+
+
+class Migration(migrations.Migration):
+    """Lock table through which processes share one run of identical computations"""
+
+    dependencies = [
+        ('funds', '0003_rolling_return_series'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SINGLE_FLIGHT, "drop table single_flight"),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+CREATE_NAV_LOADS = """
+create table nav_loads (
+    load_id bigserial primary key,
+    loaded_at timestamp with time zone not null default now(),
+    funds integer not null,
+    corrected integer not null
+);
+"""
+
+
+class Migration(migrations.Migration):
+    """Log of NAV loads. The latest load_id is part of the NAV version, so that a load which only
+        corrects historical NAVs also invalidates the cached data derived from them."""
+
+    dependencies = [
+        ('funds', '0004_single_flight'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_NAV_LOADS, "drop table nav_loads"),
+    ]
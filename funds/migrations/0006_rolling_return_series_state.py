@@ -0,0 +1,25 @@
+from django.db import migrations
+
+CREATE_STATE = """
+create table rolling_return_series_state (
+    amfi_code integer not null,
+    period integer not null,
+    built_through date,
+    primary key (amfi_code, period)
+);
+insert into rolling_return_series_state (amfi_code, period, built_through)
+    select amfi_code, period, max(date) from rolling_return_series group by amfi_code, period;
+"""
+
+
+class Migration(migrations.Migration):
+    """The NAV date each rolling return series was computed through, which an empty series can't tell,
+        e.g. the 5 year series of a 3 year old fund"""
+
+    dependencies = [
+        ('funds', '0005_nav_loads'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_STATE, "drop table rolling_return_series_state"),
+    ]
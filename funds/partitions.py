@@ -0,0 +1,37 @@
+"""Management of the yearly range partitions of nav_history"""
+
+import datetime
+
+from django.db import connection
+
+
+def nav_partitions():
+    """List the partitions of nav_history with their bounds"""
+
+    query = """select child.relname, pg_get_expr(child.relpartbound, child.oid)
+                from pg_inherits
+                join pg_class parent on pg_inherits.inhparent = parent.oid
+                join pg_class child on pg_inherits.inhrelid = child.oid
+                where parent.relname = 'nav_history'
+                order by child.relname
+            """
+    with connection.cursor() as cur:
+        cur.execute(query)
+        return cur.fetchall()
+
+
+def ensure_nav_partitions(years):
+    """Create the nav_history partitions for the given years, if they don't exist"""
+
+    created = []
+    existing = {i[0] for i in nav_partitions()}
+    for year in sorted(set(years)):
+        name = f'nav_history_y{year}'
+        if name in existing:
+            continue
+        with connection.cursor() as cur:
+            cur.execute(f"""create table if not exists {name} partition of nav_history
+                            for values from (%s) to (%s)""",
+                        (datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)))
+        created.append(name)
+    return created
@@ -0,0 +1,148 @@
+"""Persisted rolling return series, extended with each NAV load instead of being rebuilt"""
+
+from django.db import connection, transaction
+
+from MfProject.lazy import lazy_import
+from MfProject.routers import read_connection, fund_connection
+from .methods import MutualFund, NAV_AS_OF_WINDOW, nav_as_of
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+relativedelta = lazy_import('dateutil.relativedelta')
+
+insert_query = """insert into rolling_return_series (amfi_code, period, date, growth)
+                    select * from unnest(%s::int[], %s::int[], %s::date[], %s::float[])
+                    on conflict (amfi_code, period, date) do nothing"""
+
+built_query = """insert into rolling_return_series_state (amfi_code, period, built_through)
+                    values (%s, %s, %s)
+                    on conflict (amfi_code, period) do update set built_through = excluded.built_through"""
+
+
+def compute_rolling_returns(navs, period):
+    """Rolling returns of a NAV series indexed by date: the growth over the NAV as of period years earlier,
+        found the same way as nav_as_of does"""
+
+    dates = navs.index.values.astype('datetime64[D]')
+    old_dates = (navs.index - pd.DateOffset(years=period)).values.astype('datetime64[D]')
+    old_rows = np.searchsorted(dates, old_dates, side='right') - 1
+    found = (old_rows >= 0) & (dates[old_rows.clip(0)] >= old_dates - np.timedelta64(NAV_AS_OF_WINDOW, 'D'))
+    growth = navs.values[found] / navs.values[old_rows[found]] - 1
+    return pd.DataFrame({'date': navs.index[found].date, 'growth': growth})
+
+
+def _insert(amfi_code, period, returns):
+    count = len(returns)
+    with connection.cursor() as cur:
+        cur.execute(insert_query, ([int(amfi_code)] * count, [period] * count,
+                                   list(returns['date']), list(returns['growth'])))
+
+
+def rebuild_rolling_returns(amfi_code, period):
+    """Compute the whole series of a fund and period from its NAV history, e.g. after NAVs were corrected"""
+
+    navs = pd.read_sql_query(MutualFund.nav_query, connection, params=[amfi_code],
+                             index_col='date', parse_dates='date')['nav']
+    built_through = navs.index.max().date() if len(navs) else None
+    with transaction.atomic():
+        with connection.cursor() as cur:
+            cur.execute("delete from rolling_return_series where amfi_code = %s and period = %s", (amfi_code, period))
+            cur.execute(built_query, (amfi_code, period, built_through))
+        _insert(amfi_code, period, compute_rolling_returns(navs, period))
+
+
+def extend_rolling_returns(amfi_codes=None):
+    """Append the points for NAVs newer than the date every stored series was built through, or those of
+        some funds, and move that date to the latest NAV even if no point could be computed, e.g. for a fund
+        younger than the period. New NAVs and the NAVs as of period years before them are fetched with one
+        query each."""
+
+    query = """select amfi_code, period, built_through as last_date from rolling_return_series_state
+                where built_through is not null
+                and (%(codes)s::int[] is null or amfi_code = any(%(codes)s::int[]))"""
+    codes = None if amfi_codes is None else [int(i) for i in amfi_codes]
+    series = pd.read_sql_query(query, connection, params={'codes': codes})
+    if series.empty:
+        return 0
+
+    nav_query = """select amfi_code, date, nav from nav_history
+                    where amfi_code = any(%s::int[]) and date > %s"""
+    navs = pd.read_sql_query(nav_query, connection,
+                             params=[series['amfi_code'].unique().tolist(), series['last_date'].min()])
+    points = navs.merge(series, on='amfi_code')
+    points = points[points['date'] > points['last_date']].reset_index(drop=True)
+    if points.empty:
+        return 0
+
+    old_dates = [date - relativedelta.relativedelta(years=int(period))
+                 for date, period in zip(points['date'], points['period'])]
+    old_navs = nav_as_of(list(zip(points['amfi_code'].tolist(), old_dates)), conn=connection)
+    points['growth'] = points['nav'].values / np.array([i[3] for i in old_navs], dtype=float) - 1
+    built = points.groupby(['amfi_code', 'period'], as_index=False)['date'].max()
+    points = points.dropna(subset=['growth'])
+
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(insert_query, (points['amfi_code'].tolist(), points['period'].tolist(),
+                                   list(points['date']), points['growth'].tolist()))
+        cur.execute("""update rolling_return_series_state s set built_through = b.date
+                        from unnest(%s::int[], %s::int[], %s::date[]) as b(amfi_code, period, date)
+                        where s.amfi_code = b.amfi_code and s.period = b.period""",
+                    (built['amfi_code'].tolist(), built['period'].tolist(), list(built['date'])))
+    return len(points)
+
+
+def read_rolling_returns(amfi_code, period, start_date=None, end_date=None):
+    """A date window of the stored series, building or extending the series first if needed.
+        Nodes serving from a snapshot compute the series from its NAVs instead."""
+
+    conn = fund_connection()
+    if conn.vendor == 'sqlite':
+        navs = pd.read_sql_query(MutualFund.nav_query, conn, params=[amfi_code], index_col='date', parse_dates='date')
+        returns = compute_rolling_returns(navs['nav'], period)
+        if start_date is not None:
+            returns = returns[returns['date'] >= pd.Timestamp(start_date).date()]
+        if end_date is not None:
+            returns = returns[returns['date'] <= pd.Timestamp(end_date).date()]
+        return returns.reset_index(drop=True)
+
+    status_query = """select exists (select 1 from rolling_return_series_state
+                                where amfi_code = %(code)s and period = %(period)s),
+                            (select built_through from rolling_return_series_state
+                                where amfi_code = %(code)s and period = %(period)s),
+                            (select max(date) from nav_history where amfi_code = %(code)s)"""
+    params = {'code': amfi_code, 'period': period}
+    conn = read_connection()
+    with conn.cursor() as cur:
+        cur.execute(status_query, params)
+        built, built_through, latest_date = cur.fetchone()
+
+    # Only a series never built, or built before the fund had NAVs, is computed from the whole history.
+    # A built one is extended only when nav_history has a NAV newer than it was built through, and extending
+    # records that NAV's date even if no point could be computed from it, so the next request has nothing to do.
+    if not built or (built_through is None and latest_date is not None):
+        rebuild_rolling_returns(amfi_code, period)
+        conn = connection
+    elif built_through is not None and latest_date is not None and built_through < latest_date:
+        extend_rolling_returns([amfi_code])
+        conn = connection
+
+    query = "select date, growth from rolling_return_series where amfi_code = %(code)s and period = %(period)s"
+    if start_date is not None:
+        query += " and date >= %(start_date)s"
+    if end_date is not None:
+        query += " and date <= %(end_date)s"
+    query += " order by date"
+    params.update({'start_date': start_date, 'end_date': end_date})
+    return pd.read_sql_query(query, conn, params=params)
+
+
+def on_nav_loaded(sender, amfi_codes, corrected, **kwargs):
+    """Rebuild the series of funds whose historical NAVs were corrected, and extend the rest"""
+
+    if corrected:
+        with connection.cursor() as cur:
+            cur.execute("""select amfi_code, period from rolling_return_series_state
+                            where amfi_code = any(%s::int[])""", (list(corrected),))
+            for amfi_code, period in cur.fetchall():
+                rebuild_rolling_returns(amfi_code, period)
+    extend_rolling_returns([i for i in amfi_codes if i not in corrected])
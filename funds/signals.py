@@ -0,0 +1,7 @@
+"""Signals sent by the fund data pipeline"""
+
+from django.dispatch import Signal
+
+# Sent after new NAVs are loaded, with amfi_codes that got new NAVs and corrected, a dict of
+# amfi_code to the earliest date whose existing NAV changed
+nav_loaded = Signal()
@@ -0,0 +1,138 @@
+"""Coalescing of identical expensive computations, so that concurrent requests share one run"""
+
+import functools
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.utils.http import urlencode
+
+from MfProject.routers import fund_connection
+from .cache import cache_key, nav_version
+
+# Seconds between checks of the lock table while another process computes a result
+POLL_INTERVAL = 0.05
+
+_lock = threading.Lock()
+_flights = {}
+
+
+class _Flight:
+    """A running computation which callers with the same key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def single_flight(key, compute):
+    """Returns compute(), running it once for concurrent calls with the same key. Callers which find
+        it running wait and get its result, or its exception. With SINGLE_FLIGHT_SHARED the processes
+        of a node coalesce through the single_flight table too, in which case compute must return text."""
+
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = _shared_flight(key, compute) if settings.SINGLE_FLIGHT_SHARED else compute()
+    except Exception as error:
+        flight.error = error
+        raise
+    finally:
+        with _lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.result
+
+
+def _shared_flight(key, compute):
+    """Runs compute if no other process is running it, else polls the single_flight table for its result.
+        A computation whose process died is taken over after SINGLE_FLIGHT_STALE_AFTER seconds."""
+
+    flight_key = hashlib.sha256(key.encode()).hexdigest()
+    claim_query = """insert into single_flight (flight_key) values (%(key)s)
+                    on conflict (flight_key) do update set started_at = now(), finished_at = null, result = null
+                        where (single_flight.finished_at is null
+                                and single_flight.started_at < now() - %(stale)s * interval '1 second')
+                            or single_flight.finished_at < now() - %(ttl)s * interval '1 second'
+                    returning flight_key"""
+    params = {'key': flight_key, 'stale': settings.SINGLE_FLIGHT_STALE_AFTER, 'ttl': settings.SINGLE_FLIGHT_RESULT_TTL}
+
+    with connection.cursor() as cur:
+        while True:
+            cur.execute(claim_query, params)
+            if cur.fetchone() is not None:
+                break
+            cur.execute("select result from single_flight where flight_key = %s and finished_at is not null",
+                        (flight_key,))
+            result = cur.fetchone()
+            if result is not None:
+                return result[0]
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            result = compute()
+        except Exception:
+            # Waiting processes claim the key and try themselves
+            cur.execute("delete from single_flight where flight_key = %s", (flight_key,))
+            raise
+        cur.execute("update single_flight set result = %s, finished_at = now() where flight_key = %s",
+                    (result, flight_key))
+        cur.execute("delete from single_flight where finished_at < now() - %s * interval '1 second'",
+                    (settings.SINGLE_FLIGHT_RESULT_TTL,))
+    return result
+
+
+class _Unshared(Exception):
+    """Carries a response of a coalesced view which is not shared, back to the request it was made for"""
+
+    def __init__(self, request, response):
+        super().__init__(response.status_code)
+        self.request = request
+        self.response = response
+
+
+def coalesce(endpoint):
+    """Decorator for fund views, under which concurrent identical requests share one response.
+        Requests are identical if they have the same endpoint, fund and query parameters, on the same NAV date.
+        Only 200 responses are shared, with their status, content type and body. Any other response goes
+        to its own request, and requests which waited on it call the view themselves."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, amfi_code=None):
+            if amfi_code is None:
+                return view(request, amfi_code)
+
+            def compute():
+                response = view(request, amfi_code)
+                if response.status_code != 200:
+                    raise _Unshared(request, response)
+                return json.dumps([response.status_code, response['Content-Type'],
+                                   response.content.decode(response.charset)])
+
+            version = nav_version(fund_connection())
+            key = cache_key(endpoint, amfi_code, urlencode(sorted(request.GET.lists()), doseq=True), version)
+            try:
+                status, content_type, content = json.loads(single_flight(key, compute))
+            except _Unshared as unshared:
+                if unshared.request is request:
+                    return unshared.response
+                return view(request, amfi_code)
+            return HttpResponse(content, status=status, content_type=content_type)
+        return wrapper
+    return decorator
@@ -1,3 +1,103 @@
-from django.test import TestCase
+import datetime
+import decimal
+import json
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from MfProject.renderers import dumps
+from .utils import risk_metrics
+
+
+class DumpsTests(SimpleTestCase):
+    """JSON encoding of results holding NumPy arrays and pandas dataframes"""
+
+    def test_float_precision(self):
+        frame = pd.DataFrame({'nav': [1.23456789012345]})
+        self.assertEqual(json.loads(dumps(frame)), [{'nav': 1.23456789012345}])
+        self.assertEqual(json.loads(dumps({'navs': np.array([1.23456789012345])})), {'navs': [1.23456789012345]})
+
+    def test_datetimes(self):
+        frame = pd.DataFrame({
+            'date': pd.to_datetime(['2020-01-01', None]),
+            'time': pd.to_datetime(['2020-01-01 10:30', '2020-01-02 00:00']),
+        })
+        self.assertEqual(json.loads(dumps(frame)), [
+            {'date': '2020-01-01', 'time': '2020-01-01T10:30:00'},
+            {'date': None, 'time': '2020-01-02T00:00:00'},
+        ])
+        self.assertEqual(json.loads(dumps({'date': np.datetime64('2020-03-04'), 'missing': pd.NaT})),
+                         {'date': '2020-03-04', 'missing': None})
+
+    def test_object_columns(self):
+        frame = pd.DataFrame({'amount': [decimal.Decimal('10.5'), None],
+                              'date': [datetime.date(2020, 1, 1), datetime.date(2020, 1, 2)]})
+        self.assertEqual(json.loads(dumps(frame)), [{'amount': 10.5, 'date': '2020-01-01'},
+                                                    {'amount': None, 'date': '2020-01-02'}])
+        self.assertEqual(json.loads(dumps({'amount': decimal.Decimal('1.25')})), {'amount': 1.25})
+
+    def test_nested(self):
+        data = {
+            'returns': pd.DataFrame({'year': [1, 3], 'return': [0.1, 0.2]}),
+            'navs': pd.Series([10.0, 11.0], name='nav'),
+            'matrix': np.array([[1, 2], [3, 4]]),
+            'count': np.int64(2),
+            'funds': [{'amfi_code': 1, 'nav': np.float64(1.5)}],
+        }
+        self.assertEqual(json.loads(dumps(data)), {
+            'returns': [{'year': 1, 'return': 0.1}, {'year': 3, 'return': 0.2}],
+            'navs': [{'nav': 10.0}, {'nav': 11.0}],
+            'matrix': [[1, 2], [3, 4]],
+            'count': 2,
+            'funds': [{'amfi_code': 1, 'nav': 1.5}],
+        })
+
+    def test_columnar(self):
+        frame = pd.DataFrame({'date': pd.to_datetime(['2020-01-01', '2020-01-02']), 'nav': [10.0, 10.5]})
+        self.assertEqual(json.loads(dumps(frame, columnar=True)),
+                         {'date': ['2020-01-01', '2020-01-02'], 'nav': [10.0, 10.5]})
+        self.assertEqual(json.loads(dumps({'navs': frame}, columnar=True)),
+                         {'navs': {'date': ['2020-01-01', '2020-01-02'], 'nav': [10.0, 10.5]}})
+
+
+class RiskMetricsTests(SimpleTestCase):
+    """Risk metrics of every fund of a NAV dataframe"""
+
+    def setUp(self):
+        dates = pd.to_datetime(['2021-01-01', '2021-04-01', '2021-07-01', '2021-10-01', '2022-01-01'])
+        self.navs = pd.DataFrame({1: [100.0, 120, 90, 110, 130], 2: [np.nan, 50, 55, 60.5, 66.55]}, index=dates)
+
+    def test_returns_and_volatility(self):
+        metrics = risk_metrics(self.navs, risk_free_rate=0.04, periods=4)
+        returns = self.navs[1].pct_change()
+        self.assertAlmostEqual(metrics.loc[1, 'annual_return'], 0.3)
+        self.assertAlmostEqual(metrics.loc[1, 'volatility'], returns.std() * 2)
+        self.assertAlmostEqual(metrics.loc[1, 'sharpe'], (returns.mean() * 4 - 0.04) / (returns.std() * 2))
+        # The second fund starts a quarter late and grows 10% every quarter
+        self.assertAlmostEqual(metrics.loc[2, 'annual_return'], 1.331 ** (365 / 275) - 1)
+        self.assertAlmostEqual(metrics.loc[2, 'volatility'], 0)
+
+    def test_drawdown(self):
+        metrics = risk_metrics(self.navs)
+        self.assertAlmostEqual(metrics.loc[1, 'max_drawdown'], -0.25)
+        self.assertEqual(metrics.loc[1, 'peak_date'], pd.Timestamp('2021-04-01'))
+        self.assertEqual(metrics.loc[1, 'trough_date'], pd.Timestamp('2021-07-01'))
+        self.assertEqual(metrics.loc[1, 'recovery_date'], pd.Timestamp('2022-01-01'))
+        self.assertAlmostEqual(metrics.loc[2, 'max_drawdown'], 0)
+        self.assertTrue(pd.isna(metrics.loc[2, 'recovery_date']))
+
+    def test_benchmark(self):
+        metrics = risk_metrics(self.navs, benchmark=self.navs[1])
+        self.assertAlmostEqual(metrics.loc[1, 'beta'], 1)
+        self.assertAlmostEqual(metrics.loc[1, 'tracking_error'], 0)
+        self.assertAlmostEqual(metrics.loc[1, 'downside_capture'], 1)
+        self.assertAlmostEqual(metrics.loc[2, 'beta'], 0)
+
+    def test_independent_of_other_funds(self):
+        # A fund with NAVs on other dates changes neither the returns nor the metrics of the rest
+        other = pd.Series([10.0, 11, 12], index=pd.to_datetime(['2021-02-01', '2021-05-01', '2021-08-01']))
+        navs = self.navs.join(other.rename(3), how='outer')
+        alone = risk_metrics(self.navs, benchmark=self.navs[1])
+        together = risk_metrics(navs, benchmark=self.navs[1]).loc[alone.index]
+        pd.testing.assert_frame_equal(together, alone)
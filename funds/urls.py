@@ -9,6 +9,7 @@ urlpatterns = [
     path('<int:amfi_code>/latest-return', views.fund_returns),
     path('<int:amfi_code>/sip-return', views.fund_sip_returns),
     path('<int:amfi_code>/rolling-return', views.rolling_return),
+    path('<int:amfi_code>/risk-metrics', views.risk_metrics),
     path('', views.fund_info),
     path('amc-list', views.amc_list),
 ]
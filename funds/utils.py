@@ -1,6 +1,9 @@
 """Defines utility methods for use in methods.py"""
 
-import numpy as np
+from MfProject.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 def xirr_np(dates, amounts, guess=0.05, step=0.05):
@@ -28,3 +31,55 @@ def xirr_np(dates, amounts, guess=0.05, step=0.05):
         else:
             return guess
     return "XIRR not calculated"
+
+
+def risk_metrics(navs, benchmark=None, risk_free_rate=0.06, periods=252):
+    '''Calculates risk metrics for every column of a NAV dataframe (dates as index, one column per fund)
+       in a single vectorized pass. benchmark is an optional NAV series on the same kind of index.'''
+
+    dates = navs.index.values
+    values = navs.to_numpy(dtype=float)
+    # Each fund's returns are between its own consecutive NAVs, so dates which only other funds of the
+    # frame have neither break a fund's returns nor make its metrics depend on the funds next to it
+    returns = navs / navs.ffill().shift() - 1
+    excess = returns - risk_free_rate / periods
+    mean_return = returns.mean() * periods
+
+    metrics = pd.DataFrame(index=navs.columns)
+    metrics['volatility'] = returns.std() * np.sqrt(periods)
+    metrics['sharpe'] = (mean_return - risk_free_rate) / metrics['volatility']
+    downside = np.sqrt((excess.clip(upper=0) ** 2).mean()) * np.sqrt(periods)
+    metrics['sortino'] = (mean_return - risk_free_rate) / downside
+
+    first, last = navs.notna().idxmax(), navs[::-1].notna().idxmax()
+    years = (last - first).dt.days / 365
+    metrics['annual_return'] = (navs.ffill().iloc[-1] / navs.bfill().iloc[0]) ** (1 / years) - 1
+
+    # Drawdowns against the running peak; gaps are carried forward so they neither peak nor trough
+    filled = np.fmax.accumulate(np.where(np.isnan(values), -np.inf, values), axis=0)
+    peaks = np.where(np.isinf(filled), np.nan, filled)
+    drawdowns = np.where(np.isnan(values), 0, values / peaks - 1)
+    rows = np.arange(len(values))[:, None]
+    peak_rows = np.maximum.accumulate(np.where(values == peaks, rows, 0), axis=0)
+    trough_rows = drawdowns.argmin(axis=0) if len(values) else np.zeros(values.shape[1], dtype=int)
+    columns = np.arange(values.shape[1])
+    peak_values = peaks[trough_rows, columns]
+    recovered = (rows > trough_rows) & (values >= peak_values)
+    metrics['max_drawdown'] = drawdowns[trough_rows, columns]
+    metrics['peak_date'] = dates[peak_rows[trough_rows, columns]]
+    metrics['trough_date'] = dates[trough_rows]
+    metrics['recovery_date'] = np.where(recovered.any(axis=0), dates[recovered.argmax(axis=0)], None)
+
+    if benchmark is not None:
+        bench_returns = benchmark.dropna().pct_change().reindex(navs.index)
+        valid = returns.notna() & bench_returns.notna().values[:, None]
+        fund = returns.where(valid)
+        bench = pd.DataFrame(np.where(valid, bench_returns.values[:, None], np.nan),
+                             index=navs.index, columns=navs.columns)
+        covariance = ((fund - fund.mean()) * (bench - bench.mean())).sum() / (valid.sum() - 1)
+        metrics['beta'] = covariance / bench.var()
+        metrics['tracking_error'] = (fund - bench).std() * np.sqrt(periods)
+        down = bench < 0
+        metrics['downside_capture'] = fund.where(down).mean() / bench.where(down).mean()
+
+    return metrics
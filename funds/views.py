@@ -1,9 +1,14 @@
 """Views related to fund analysis"""
 
+import datetime
+import math
+
 from django.http import HttpResponse
-from django.http import JsonResponse
+
+from MfProject.renderers import FastJsonResponse
 
 from .methods import MutualFund, FundAdvanced, fund_search, fetch_amc_list
+from .singleflight import coalesce
 
 
 def fund_info(request, amfi_code=None):
@@ -17,10 +22,9 @@ def fund_info(request, amfi_code=None):
         result.update({'returns': returns})
     elif search is not None:
         result = fund_search(search)
-        result = result.to_dict(orient='records')
     else:
         return HttpResponse("Provide a search string or amfi_code", status=400)
-    return JsonResponse(result, safe=False)
+    return FastJsonResponse(result)
 
 
 def nav_history(request, amfi_code=None):
@@ -29,12 +33,11 @@ def nav_history(request, amfi_code=None):
     if amfi_code is None:
         return HttpResponse("Provide an amfi_code", status=400)
     mf = MutualFund(amfi_code)
-    nav_hist = mf.nav_history.reset_index()
-    nav_hist['date'] = nav_hist['date'].dt.date
-    nav_hist_dict = nav_hist.to_dict(orient='records')
-    return JsonResponse(nav_hist_dict, safe=False)
+    columnar = request.GET.get('layout') == 'columnar'
+    return FastJsonResponse(mf.nav_history.reset_index(), columnar=columnar)
 
 
+@coalesce('latest-return')
 def fund_returns(request, amfi_code=None):
     """1-3-5 year returns of a fund"""
 
@@ -42,9 +45,10 @@ def fund_returns(request, amfi_code=None):
         return HttpResponse("Provide an amfi_code", status=400)
     mf = MutualFund(amfi_code)
     returns = mf.latest_returns()
-    return JsonResponse(returns, safe=False)
+    return FastJsonResponse(returns)
 
 
+@coalesce('sip-return')
 def fund_sip_returns(request, amfi_code=None):
     """1-3-5 year SIP returns of a fund"""
 
@@ -52,9 +56,10 @@ def fund_sip_returns(request, amfi_code=None):
         return HttpResponse("Provide an amfi_code", status=400)
     mf = MutualFund(amfi_code)
     returns = mf.sip_returns()
-    return JsonResponse(returns, safe=False)
+    return FastJsonResponse(returns)
 
 
+@coalesce('rolling-return')
 def rolling_return(request, amfi_code=None):
     """Rolling returns based on provided frequency and period"""
 
@@ -66,15 +71,36 @@ def rolling_return(request, amfi_code=None):
     summary = request.GET.get('summary', None)
     mf = FundAdvanced(amfi_code)
     rolling_returns = mf.rolling_returns(period, start_date, end_date)
-    rolling_returns = rolling_returns.to_dict(orient='records')
     returns_dict = {'returns': rolling_returns}
     if summary is not None:
-        rolling_summary = mf.rolling_summary(period, start_date, end_date)
-    returns_dict['summary'] = rolling_summary
-    return JsonResponse(returns_dict, safe=False)
+        returns_dict['summary'] = mf.rolling_summary(period, start_date, end_date)
+    return FastJsonResponse(returns_dict)
+
+
+def risk_metrics(request, amfi_code=None):
+    """Risk metrics of a fund, optionally against a benchmark fund"""
+
+    if amfi_code is None:
+        return HttpResponse("Provide an amfi_code", status=400)
+    try:
+        benchmark = request.GET.get('benchmark', None)
+        benchmark = None if benchmark is None else int(benchmark)
+        risk_free_rate = float(request.GET.get('risk_free_rate', 0.06))
+        start_date, end_date = (None if request.GET.get(i) is None else datetime.date.fromisoformat(request.GET[i])
+                                for i in ('start_date', 'end_date'))
+    except ValueError:
+        return HttpResponse("Provide a numeric benchmark and risk_free_rate, and dates as YYYY-MM-DD", status=400)
+    if not math.isfinite(risk_free_rate):
+        return HttpResponse("Provide a finite risk_free_rate", status=400)
+    mf = FundAdvanced(amfi_code)
+    try:
+        metrics = mf.risk_metrics(benchmark, risk_free_rate, start_date, end_date)
+    except ValueError as error:
+        return HttpResponse(str(error), status=400)
+    return FastJsonResponse(metrics)
 
 
 def amc_list(request):
     """Return a list of AMCs"""
 
-    return JsonResponse(fetch_amc_list(), safe=False)
+    return FastJsonResponse(fetch_amc_list())
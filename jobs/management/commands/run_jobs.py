@@ -0,0 +1,69 @@
+"""Runs queued analytics jobs in a process pool"""
+
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from jobs.methods import claim_jobs, execute_job, finish_job, purge_expired_jobs, release_jobs
+
+
+def init_worker():
+    """Set up Django in a freshly spawned pool process, with its own database connection"""
+
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MfProject.settings')
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = "Run analytics jobs from the queue until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help="Size of the process pool")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--purge-every', type=int, default=300, help="Seconds between purges of expired jobs")
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        running = {}
+        last_purge = 0
+
+        # Spawned rather than forked, so the pool never shares this process's database socket
+        with ProcessPoolExecutor(processes, mp_context=get_context('spawn'), initializer=init_worker) as pool:
+            self.stdout.write(f"Running jobs with {processes} processes")
+            try:
+                while True:
+                    if time.monotonic() - last_purge > options['purge_every']:
+                        purged = purge_expired_jobs()
+                        if purged:
+                            self.stdout.write(f"Purged {purged} expired jobs")
+                        last_purge = time.monotonic()
+
+                    for job_id, kind, params, user_id in claim_jobs(processes - len(running)):
+                        running[pool.submit(execute_job, kind, params, user_id)] = job_id
+
+                    if not running:
+                        connection.close()
+                        time.sleep(options['poll'])
+                        continue
+
+                    done, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job_id = running.pop(future)
+                        try:
+                            finish_job(job_id, result=future.result())
+                        except Exception:
+                            # A failure to store the result fails the job too, instead of stopping
+                            # the loop and leaving the other claimed jobs running until they go stale
+                            error = traceback.format_exc()
+                            finish_job(job_id, error=error)
+                            self.stderr.write(f"Job {job_id} failed\n{error}")
+            except KeyboardInterrupt:
+                released = release_jobs(running.values()) if running else 0
+                self.stdout.write(f"Stopping, put {released} running jobs back in the queue for the next worker")
@@ -0,0 +1,199 @@
+"""A database backed queue for expensive analytics, run outside the web workers"""
+
+import datetime
+import hashlib
+import inspect
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+
+from funds.cache import nav_version
+from MfProject.renderers import dumps
+
+
+def rolling_return(amfi_code, period=1, start_date=None, end_date=None, summary=False):
+    """Rolling returns of a fund, as served by the rolling-return endpoint"""
+
+    from funds.methods import FundAdvanced
+
+    mf = FundAdvanced(amfi_code)
+    returns_dict = {'returns': mf.rolling_returns(period, start_date, end_date)}
+    if summary:
+        returns_dict['summary'] = mf.rolling_summary(period, start_date, end_date)
+    return returns_dict
+
+
+def sip_return(amfi_code):
+    """SIP returns of a fund"""
+
+    from funds.methods import MutualFund
+
+    return MutualFund(amfi_code).sip_returns()
+
+
+def portfolio(user_id):
+    """Holdings of a user with XIRR"""
+
+    from portfolio.methods import UserPortfolio
+
+    return UserPortfolio(user_id).fetch_portfolio()
+
+
+def investment_summary(user_id):
+    """Investment summary of a user"""
+
+    from portfolio.methods import UserPortfolio
+
+    return UserPortfolio(user_id).investment_summary()
+
+
+# Job kind: (function, whether it runs on behalf of the requesting user)
+JOB_KINDS = {
+    'rolling_return': (rolling_return, False),
+    'sip_return': (sip_return, False),
+    'portfolio': (portfolio, True),
+    'investment_summary': (investment_summary, True),
+}
+
+
+# Parameter: function checking a value of it, raising TypeError or ValueError if the value is invalid
+PARAM_CHECKS = {
+    'amfi_code': int,
+    'period': int,
+    'start_date': lambda value: value is None or datetime.date.fromisoformat(value),
+    'end_date': lambda value: value is None or datetime.date.fromisoformat(value),
+    'summary': lambda value: isinstance(value, bool) or int(value),
+}
+
+
+def validate_params(kind, params):
+    """Reason why params are not valid for a kind of job, or None if they are. Checks that they match the
+        job's function and that each value can be used, so that bad parameters fail the submission instead
+        of the job."""
+
+    if not isinstance(params, dict):
+        return "params must be an object"
+    function, for_user = JOB_KINDS[kind]
+    if for_user and 'user_id' in params:
+        return "user_id can't be passed, jobs run for the logged in user"
+    try:
+        inspect.signature(function).bind(**dict(params, user_id=None) if for_user else params)
+    except TypeError as error:
+        return str(error)
+    for name, value in params.items():
+        try:
+            PARAM_CHECKS.get(name, lambda value: value)(value)
+        except (TypeError, ValueError):
+            return f"Invalid value of {name}: {value!r}"
+    if 'amfi_code' in params:
+        with connection.cursor() as cur:
+            cur.execute("select 1 from fund_master where amfi_code = %s", (int(params['amfi_code']),))
+            if cur.fetchone() is None:
+                return f"Fund {params['amfi_code']} not found"
+    return None
+
+
+def execute_job(kind, params, user_id=None):
+    """Runs a job and returns its result as JSON. Called in the worker's process pool."""
+
+    function, for_user = JOB_KINDS[kind]
+    if for_user:
+        params = dict(params, user_id=user_id)
+    # Results are stored as jsonb, which has no NaN or Infinity, e.g. in the summary of a one point series
+    return json.dumps(json.loads(dumps(function(**params)), parse_constant=lambda constant: None))
+
+
+def submit_job(kind, params, user_id=None):
+    """Queue a job, unless an identical one is pending, running, or has an unexpired result.
+        Returns the job id and status."""
+
+    # Results depend on the NAVs, so a new NAV load makes identical jobs distinct
+    job_key = hashlib.sha256(json.dumps([kind, params, user_id, str(nav_version())],
+                                        sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+    # Finished results of a user's jobs are not reused, as the user's writes don't invalidate them.
+    # Failed jobs are not reused either, so that a transient failure is retried by the next submission.
+    existing_query = """select job_id, status from analytics_jobs
+                        where job_key = %s
+                        and (status in ('pending', 'running')
+                            or (status = 'done' and expires_at > now() and user_id is null))
+                        order by created_at desc limit 1"""
+    insert_query = """insert into analytics_jobs (job_key, kind, params, user_id)
+                        values (%s, %s, %s, %s)
+                        on conflict (job_key) where status in ('pending', 'running') do nothing
+                        returning job_id, status"""
+    with connection.cursor() as cur:
+        cur.execute(existing_query, (job_key,))
+        job = cur.fetchone()
+        if job is None:
+            cur.execute(insert_query, (job_key, kind, json.dumps(params, cls=DjangoJSONEncoder), user_id))
+            job = cur.fetchone()
+        if job is None:
+            # Lost a race with an identical submission
+            cur.execute(existing_query, (job_key,))
+            job = cur.fetchone()
+    return {'job_id': job[0], 'status': job[1]}
+
+
+def get_job(job_id):
+    """Fetch a job with its result, if it still exists"""
+
+    query = """select job_id, kind, user_id, status, result, error, created_at, started_at, finished_at, expires_at
+                from analytics_jobs where job_id = %s and (expires_at is null or expires_at > now())"""
+    with connection.cursor() as cur:
+        cur.execute(query, (job_id,))
+        result = cur.fetchone()
+        keys = [i[0] for i in cur.description]
+    if result is None:
+        return None
+    return dict(zip(keys, result))
+
+
+def release_jobs(job_ids):
+    """Put running jobs back in the queue, e.g. those of a worker shutting down, so that other workers
+        pick them up right away instead of after JOB_STALE_AFTER seconds"""
+
+    with connection.cursor() as cur:
+        cur.execute("""update analytics_jobs set status = 'pending', started_at = null
+                        where job_id = any(%s) and status = 'running'""", (list(job_ids),))
+        return cur.rowcount
+
+
+def claim_jobs(limit):
+    """Mark up to limit pending jobs as running and return them.
+        Jobs left running by a worker that died are picked up again after JOB_STALE_AFTER seconds."""
+
+    query = """update analytics_jobs set status = 'running', started_at = now()
+                where job_id in (
+                    select job_id from analytics_jobs
+                        where status = 'pending'
+                            or (status = 'running' and started_at < now() - %s * interval '1 second')
+                        order by created_at
+                        limit %s
+                        for update skip locked
+                )
+                returning job_id, kind, params, user_id"""
+    with connection.cursor() as cur:
+        cur.execute(query, (settings.JOB_STALE_AFTER, limit))
+        return cur.fetchall()
+
+
+def finish_job(job_id, result=None, error=None):
+    """Store the result or error of a job, which is kept for JOB_RESULT_TTL seconds"""
+
+    query = """update analytics_jobs
+                set status = %s, result = %s, error = %s, finished_at = now(),
+                    expires_at = now() + %s * interval '1 second'
+                where job_id = %s"""
+    with connection.cursor() as cur:
+        cur.execute(query, ('failed' if error else 'done', result, error, settings.JOB_RESULT_TTL, job_id))
+
+
+def purge_expired_jobs():
+    """Delete jobs whose results have expired"""
+
+    with connection.cursor() as cur:
+        cur.execute("delete from analytics_jobs where expires_at < now()")
+        return cur.rowcount
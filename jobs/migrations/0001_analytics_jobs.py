@@ -0,0 +1,34 @@
+from django.db import migrations
+
+CREATE_JOBS = """
+create table analytics_jobs (
+    job_id bigserial primary key,
+    job_key text not null,
+    kind text not null,
+    params jsonb not null,
+    user_id integer references auth_user (id) on delete cascade,
+    status text not null default 'pending',
+    result jsonb,
+    error text,
+    created_at timestamptz not null default now(),
+    started_at timestamptz,
+    finished_at timestamptz,
+    expires_at timestamptz
+);
+
+create unique index analytics_jobs_active_key_idx on analytics_jobs (job_key) where status in ('pending', 'running');
+create index analytics_jobs_key_idx on analytics_jobs (job_key, finished_at desc);
+create index analytics_jobs_pending_idx on analytics_jobs (created_at) where status = 'pending';
+"""
+
+
+class Migration(migrations.Migration):
+    """Queue table for analytics jobs run by manage.py run_jobs"""
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_JOBS, "drop table analytics_jobs"),
+    ]
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('', views.submit),
+    path('<int:job_id>', views.status),
+    path('<int:job_id>/result', views.result),
+]
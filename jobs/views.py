@@ -0,0 +1,68 @@
+"""Views to submit analytics jobs and poll for their results"""
+
+import json
+
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+from .methods import JOB_KINDS, submit_job, get_job, validate_params
+
+
+@api_view(['POST'])
+def submit(request):
+    """Queue a job. Jobs on a user's portfolio need the user to be logged in."""
+
+    body_unicode = request.body.decode('utf-8')
+    body = json.loads(body_unicode)
+    kind = body.get('kind')
+    if kind not in JOB_KINDS:
+        return Response({'message': f"Provide a kind, one of {', '.join(JOB_KINDS)}"}, status=400)
+
+    user_id = None
+    if JOB_KINDS[kind][1]:
+        if not request.user.is_authenticated:
+            return Response({'message': "Login required for this job"}, status=401)
+        user_id = request.user.id
+
+    params = body.get('params', {})
+    error = validate_params(kind, params)
+    if error is not None:
+        return Response({'message': error}, status=400)
+
+    job = submit_job(kind, params, user_id)
+    return Response(job, status=202)
+
+
+def _fetch_job(request, job_id):
+    """Fetch a job if the requesting user may see it"""
+
+    job = get_job(job_id)
+    if job is None or (job['user_id'] is not None and job['user_id'] != request.user.id):
+        return None
+    return job
+
+
+@api_view(['GET'])
+def status(request, job_id):
+    """Status of a job"""
+
+    job = _fetch_job(request, job_id)
+    if job is None:
+        return Response({'message': "Job not found"}, status=404)
+    # The error is the worker's traceback, which is for the server's eyes only
+    del job['result'], job['error']
+    return Response(job)
+
+
+@api_view(['GET'])
+def result(request, job_id):
+    """Result of a finished job"""
+
+    job = _fetch_job(request, job_id)
+    if job is None:
+        return Response({'message': "Job not found"}, status=404)
+    if job['status'] == 'failed':
+        return Response({'message': "Job failed"}, status=500)
+    if job['status'] != 'done':
+        return Response({'message': f"Job is {job['status']}"}, status=409)
+    return Response(job['result'])
@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class PortfolioConfig(AppConfig):
     name = 'portfolio'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.db.models.signals import post_delete, post_save
+        from rest_framework.authtoken.models import Token
+
+        from .authentication import on_token_deleted, on_user_saved
+
+        post_delete.connect(on_token_deleted, sender=Token)
+        post_save.connect(on_user_saved, sender=User)
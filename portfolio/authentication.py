@@ -0,0 +1,93 @@
+"""Token authentication which keeps recently used tokens in memory instead of querying them per request"""
+
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+_lock = threading.Lock()
+_tokens = collections.OrderedDict()
+
+
+def revoked_key(key):
+    """Cache key of the marker which tells every worker to drop a cached token"""
+
+    return f'token-revoked:{key}'
+
+
+def revoke_tokens(*keys):
+    """Drop tokens from this process's cache, and mark them revoked in the cache shared by the node's
+        workers. The markers live as long as a cached token can, so other workers drop theirs on next use."""
+
+    with _lock:
+        for key in keys:
+            _tokens.pop(key, None)
+    caches['portfolio'].set_many({revoked_key(i): True for i in keys}, settings.TOKEN_CACHE_TTL)
+
+
+def on_token_deleted(sender, instance, **kwargs):
+    """Revoke a deleted token, e.g. on logout or rotation"""
+
+    revoke_tokens(instance.key)
+
+
+def on_user_saved(sender, instance, **kwargs):
+    """Revoke the cached tokens of a user who changed, so that a deactivated user is refused and
+        views see the current user"""
+
+    from rest_framework.authtoken.models import Token
+
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+    if keys:
+        revoke_tokens(*keys)
+
+
+def token_expired(token):
+    """Whether a token is older than TOKEN_EXPIRY seconds, if that is set"""
+
+    return bool(settings.TOKEN_EXPIRY) and (timezone.now() - token.created).total_seconds() > settings.TOKEN_EXPIRY
+
+
+def issue_token(user):
+    """The token of a user logging in, replacing an expired one so that the user gets a token which works"""
+
+    from rest_framework.authtoken.models import Token
+
+    token, created = Token.objects.get_or_create(user=user)
+    if not created and token_expired(token):
+        token.delete()
+        token = Token.objects.create(user=user)
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication with an LRU cache of up to TOKEN_CACHE_SIZE tokens per process, each kept for
+        TOKEN_CACHE_TTL seconds. Tokens older than TOKEN_EXPIRY seconds are refused, if it is set."""
+
+    def authenticate_credentials(self, key):
+        now = time.monotonic()
+        with _lock:
+            cached = _tokens.get(key)
+            if cached is not None:
+                _tokens.move_to_end(key)
+
+        if cached is not None and now - cached[2] < settings.TOKEN_CACHE_TTL \
+                and not caches['portfolio'].get(revoked_key(key)):
+            user, token = cached[0], cached[1]
+        else:
+            user, token = super().authenticate_credentials(key)
+            with _lock:
+                _tokens[key] = (user, token, now)
+                _tokens.move_to_end(key)
+                while len(_tokens) > settings.TOKEN_CACHE_SIZE:
+                    _tokens.popitem(last=False)
+
+        if token_expired(token):
+            token.delete()
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        return user, token
@@ -0,0 +1,44 @@
+"""Per-user cache of portfolio data, invalidated by the write paths which change it"""
+
+import functools
+
+from django.core.cache import caches
+
+from funds.cache import nav_version, cache_key
+
+# Cached entries of a user, and whether they change with the latest NAVs
+USER_ENTRIES = {
+    'analytics': True,
+    'folios': False,
+    'banks': False,
+}
+
+
+def user_cache_key(user_id, name):
+    """Cache key of a user's entry. NAV dependent entries are keyed on the NAV date as well,
+        so that a NAV load invalidates them for all users at once."""
+
+    return cache_key('user', user_id, name, nav_version() if USER_ENTRIES[name] else '')
+
+
+def user_cached(name):
+    """Caches the result of a method of UserInfo or its subclasses per user"""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self):
+            user_cache = caches['portfolio']
+            key = user_cache_key(self.user_id, name)
+            result = user_cache.get(key)
+            if result is None:
+                result = method(self)
+                user_cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
+
+
+def invalidate_user(user_id, *names):
+    """Drop the given cached entries of a user after a write"""
+
+    caches['portfolio'].delete_many([user_cache_key(user_id, name) for name in names])
@@ -0,0 +1,204 @@
+"""Server-sent events pushing holdings values to subscribed users when new NAVs are loaded"""
+
+import asyncio
+import collections
+import functools
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import exceptions
+
+from funds.cache import nav_version
+from MfProject.lazy import lazy_import
+from MfProject.renderers import dumps
+from MfProject.routers import read_connection, unpin
+
+pd = lazy_import('pandas')
+
+LIVE_PATH = '/users/live'
+
+holdings_query = """select user_id, amfi_code, sum(units)::float as units from transaction_history
+                    where user_id = any(%s::int[])
+                    group by user_id, amfi_code
+                    having abs(sum(units)) > 0.1"""
+
+fund_navs_query = """select lnav.amfi_code, lnav.fund_name, lnav.date, lnav.nav::float as nav,
+                        prev.nav::float as prev_nav
+                    from latest_nav lnav
+                    left join lateral (
+                        select nav from nav_history
+                            where amfi_code = lnav.amfi_code and date < lnav.date
+                            order by date desc limit 1
+                    ) prev on true
+                    where lnav.amfi_code = any(%s::int[])"""
+
+
+def database_task(function):
+    """Runs a function using the database in a worker thread, as a request would: with the thread's
+        replica choice reset, and its connection closed after it"""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        unpin()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper)
+
+
+@database_task
+def authenticate(key):
+    """User of a token, or None if the token is not valid"""
+
+    from .authentication import CachedTokenAuthentication
+
+    try:
+        return CachedTokenAuthentication().authenticate_credentials(key)[0]
+    except exceptions.AuthenticationFailed:
+        return None
+
+
+@database_task
+def current_nav_version():
+    return nav_version()
+
+
+@database_task
+def holdings_events(user_ids):
+    """The holdings event of each user. The NAV change of each fund is computed once and then
+        applied to the units of every user holding it."""
+
+    conn = read_connection()
+    holdings = pd.read_sql_query(holdings_query, conn, params=[list(user_ids)])
+    funds = pd.read_sql_query(fund_navs_query, conn, params=[holdings['amfi_code'].unique().tolist()],
+                              index_col='amfi_code')
+    funds['change'] = funds['nav'] - funds['prev_nav']
+
+    holdings = holdings.merge(funds, left_on='amfi_code', right_index=True)
+    holdings['value'] = holdings['units'] * holdings['nav']
+    holdings['day_change'] = holdings['units'] * holdings['change'].fillna(0)
+    columns = ['amfi_code', 'fund_name', 'date', 'nav', 'change', 'units', 'value', 'day_change']
+
+    events = {}
+    for user_id, user_holdings in holdings.groupby('user_id'):
+        events[user_id] = dumps({
+            'nav_date': user_holdings['date'].max(),
+            'value': user_holdings['value'].sum(),
+            'day_change': user_holdings['day_change'].sum(),
+            'funds': user_holdings[columns],
+        })
+    return events
+
+
+class LiveBroker:
+    """Subscriptions of this process. While there are any, checks for a new NAV load every
+        LIVE_POLL_SECONDS and pushes every subscriber's holdings when one lands."""
+
+    def __init__(self):
+        self.subscribers = collections.defaultdict(set)
+        self.task = None
+
+    async def subscribe(self, user_id):
+        """A queue receiving the user's holdings events, starting with the current holdings"""
+
+        queue = asyncio.Queue()
+        self.subscribers[user_id].add(queue)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.poll())
+        try:
+            events = await holdings_events([user_id])
+        except Exception:
+            self.unsubscribe(user_id, queue)
+            raise
+        if user_id in events:
+            queue.put_nowait(events[user_id])
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        self.subscribers[user_id].discard(queue)
+        if not self.subscribers[user_id]:
+            del self.subscribers[user_id]
+
+    async def poll(self):
+        version = None
+        try:
+            while self.subscribers:
+                try:
+                    latest = await current_nav_version()
+                    if version is not None and latest != version and self.subscribers:
+                        await self.publish()
+                    version = latest
+                except Exception as error:
+                    # Subscribers keep their streams, and get the next NAV load instead
+                    print(error)
+                await asyncio.sleep(settings.LIVE_POLL_SECONDS)
+        finally:
+            self.task = None
+
+    async def publish(self):
+        """Compute the events of all subscribers in one go, and hand each to the user's connections"""
+
+        events = await holdings_events(list(self.subscribers))
+        for user_id, event in events.items():
+            for queue in self.subscribers.get(user_id, ()):
+                queue.put_nowait(event)
+
+
+broker = LiveBroker()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_holdings(scope, receive, send):
+    """Server-sent events of the holdings of the user whose token is in the token query parameter,
+        as EventSource can't send an Authorization header, or in the header"""
+
+    token = parse_qs(scope['query_string'].decode()).get('token', [None])[0]
+    header = dict(scope['headers']).get(b'authorization', b'').decode().split()
+    if token is None and len(header) == 2 and header[0].lower() == 'token':
+        token = header[1]
+    user = await authenticate(token) if token else None
+    if user is None:
+        await send({'type': 'http.response.start', 'status': 401, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Invalid or missing token'})
+        return
+
+    queue = await broker.subscribe(user.id)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')]})
+        while not disconnect.done():
+            event = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({event, disconnect}, timeout=settings.LIVE_KEEPALIVE_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if event in done:
+                body = f'event: holdings\ndata: {event.result()}\n\n'
+            else:
+                event.cancel()
+                body = ': keepalive\n\n'
+            if not disconnect.done():
+                await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+    finally:
+        disconnect.cancel()
+        broker.unsubscribe(user.id, queue)
+
+
+class LivePushApplication:
+    """ASGI application serving the live holdings stream, and everything else through Django"""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == LIVE_PATH:
+            await stream_holdings(scope, receive, send)
+        else:
+            await self.application(scope, receive, send)
@@ -0,0 +1,293 @@
+"""Replays a reproducible traffic mix against a running server and reports latency percentiles"""
+
+import datetime
+import json
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from portfolio.authentication import issue_token
+from portfolio.methods import UserInfo, UserInvestmentManager
+
+# Seeded users invest monthly in SEED_YEAR, and add-transaction requests invest in TRAFFIC_YEAR
+SEED_YEAR = 2019
+TRAFFIC_YEAR = 2020
+
+# Route: (weight, method, path, whether it needs a token). {fund} and {search} are filled in per request.
+# Routes in WRITE_ROUTES only run with --writes, and as disposable users which are deleted after the run.
+TRAFFIC_MIX = {
+    'fund-search': (6, 'GET', '/funds/?search={search}', False),
+    'fund': (4, 'GET', '/funds/{fund}', False),
+    'fund-info': (4, 'GET', '/funds/{fund}/info', False),
+    'nav-history': (8, 'GET', '/funds/{fund}/nav-history', False),
+    'latest-return': (8, 'GET', '/funds/{fund}/latest-return', False),
+    'sip-return': (6, 'GET', '/funds/{fund}/sip-return', False),
+    'rolling-return': (4, 'GET', '/funds/{fund}/rolling-return?period=3&summary=1', False),
+    'risk-metrics': (2, 'GET', '/funds/{fund}/risk-metrics', False),
+    'amc-list': (2, 'GET', '/funds/amc-list', False),
+    'user': (4, 'GET', '/users/', True),
+    'transactions': (8, 'GET', '/users/transactions', True),
+    'export-transactions': (1, 'GET', '/users/transactions?export=csv', True),
+    'add-transaction': (1, 'POST', '/users/transactions', True),
+    'portfolio': (10, 'GET', '/users/portfolio', True),
+    'investment-summary': (10, 'GET', '/users/investment-summary', True),
+    'allocation': (3, 'GET', '/users/allocation', True),
+    'simulate-switch': (1, 'POST', '/users/simulate-switch', True),
+    'folios': (3, 'GET', '/users/folios', True),
+    'fund-folios': (2, 'GET', '/users/folios/{fund}', True),
+    'banks': (2, 'GET', '/users/banks', True),
+    'add-folio': (1, 'POST', '/users/folios', True),
+    'add-bank': (1, 'POST', '/users/banks', True),
+    'check-email': (1, 'POST', '/users/check-email/', False),
+    'login': (2, 'POST', '/users/login/', False),
+    'signup': (1, 'POST', '/users/signup/', False),
+    'logout': (1, 'POST', '/users/logout/', True),
+}
+WRITE_ROUTES = {'add-transaction', 'add-folio', 'add-bank', 'signup', 'logout'}
+
+SEARCHES = ['axis bluechip', 'mirae large cap', 'hdfc mid', 'parag parikh', 'sbi small', 'icici liquid']
+PASSWORD = 'loadtest-password'
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+
+class Command(BaseCommand):
+    help = "Seed synthetic users and replay a weighted mix of requests to every route at a target concurrency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--users', type=int, default=20, help="Synthetic users to seed and log in as")
+        parser.add_argument('--funds', type=int, default=50, help="Funds to spread fund requests over")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the users, funds and request sequence")
+        parser.add_argument('--mix', help="JSON file of route weights overriding the default mix")
+        parser.add_argument('--writes', action='store_true',
+                            help=f"Also send {', '.join(sorted(WRITE_ROUTES))}, as disposable users")
+        parser.add_argument('--baseline', help="JSON report to compare against")
+        parser.add_argument('--save', help="Write the report as JSON, e.g. to use as the next baseline")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Fractional p95 increase or throughput drop reported as a regression")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        funds = self.sample_funds(rng, options['funds'])
+        # Seeding has its own generator, so the request sequence is the same whether or not users exist
+        tokens = self.seed_users(random.Random(options['seed']), options['users'], funds)
+
+        weights = {name: route[0] for name, route in TRAFFIC_MIX.items()}
+        if options['mix']:
+            with open(options['mix']) as file:
+                weights.update(json.load(file))
+            unknown = set(weights) - set(TRAFFIC_MIX)
+            if unknown:
+                raise CommandError(f"Unknown routes in {options['mix']}: {', '.join(sorted(unknown))}")
+        names = [name for name, weight in weights.items() if weight > 0
+                 and (options['writes'] or name not in WRITE_ROUTES)]
+        sequence = rng.choices(names, [weights[i] for i in names], k=options['requests'])
+
+        # Writes go to users made for this run, and logouts each get a user of their own as they delete its token
+        prefix = f'loadtest_scratch_{uuid.uuid4().hex[:8]}_'
+        try:
+            scratch = {
+                'writes': [self.scratch_user(f'{prefix}{i}', i) for i in range(options['users'])]
+                if options['writes'] else [],
+                'logout': [self.scratch_user(f'{prefix}logout_{i}', i) for i in range(sequence.count('logout'))],
+                'prefix': prefix,
+            }
+            plan = [self.build_request(rng, name, funds, tokens, scratch) for name in sequence]
+
+            self.stdout.write(f"Sending {len(plan)} requests with concurrency {options['concurrency']}")
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                results = list(pool.map(lambda request: self.send(options['base_url'], request), plan))
+            elapsed = time.perf_counter() - started
+        finally:
+            self.delete_users(prefix)
+
+        report = self.summarise(results, elapsed)
+        self.print_report(report)
+        if options['save']:
+            with open(options['save'], 'w') as file:
+                json.dump(report, file, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            regressions = self.compare(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError(f"{regressions} regressions against {options['baseline']}")
+
+    def sample_funds(self, rng, count):
+        """A reproducible sample of funds with NAVs from the start of SEED_YEAR to the end of TRAFFIC_YEAR,
+            so that every seeded and requested transaction finds a NAV"""
+
+        query = """select amfi_code from nav_history
+                    where date between %(start)s and %(end)s
+                    group by amfi_code
+                    having min(date) <= %(start)s + 10 and max(date) >= %(end)s - 21
+                    order by amfi_code"""
+        with connection.cursor() as cur:
+            cur.execute(query, {'start': datetime.date(SEED_YEAR, 1, 1), 'end': datetime.date(TRAFFIC_YEAR, 12, 31)})
+            codes = [i[0] for i in cur.fetchall()]
+        if not codes:
+            raise CommandError(f"No funds with NAVs from {SEED_YEAR} to {TRAFFIC_YEAR} to send requests for")
+        return rng.sample(codes, min(count, len(codes)))
+
+    def seed_users(self, rng, count, funds):
+        """Create the synthetic users with a bank and a few SIP-like transactions, and return their tokens.
+            Users seeded by an earlier run are reused."""
+
+        tokens = []
+        for i in range(count):
+            username = f'loadtest_{i}'
+            user = User.objects.filter(username=username).first()
+            if user is None:
+                user = User.objects.create_user(username, f'{username}@example.com', PASSWORD)
+                UserInfo(user.id).create_user(mobile=f'9{i:09d}', alt_mobile=None, alt_email=None,
+                                              pan=f'LOADT{i:04d}Z', d_o_b='1990-01-01')
+                manager = UserInvestmentManager(user.id)
+                manager.create_bank('Load Test Bank', f'{i:012d}', 'LTST0000001')
+                for fund in rng.sample(funds, min(3, len(funds))):
+                    for month in range(1, 13):
+                        manager.add_transaction(amfi_code=fund, trx_date=f'{SEED_YEAR}-{month:02d}-10',
+                                                trx_type='INV', amount=5000)
+            token = issue_token(user)
+            tokens.append((user.username, token.key))
+        return tokens
+
+    def scratch_user(self, username, i):
+        """Create a disposable user with a bank, so that folios can be added, and return their token"""
+
+        user = User.objects.create_user(username, f'{username}@example.com', PASSWORD)
+        UserInfo(user.id).create_user(mobile=None, alt_mobile=None, alt_email=None, pan=None, d_o_b=None)
+        UserInvestmentManager(user.id).create_bank('Load Test Bank', f'{i:012d}', 'LTST0000001')
+        return user.username, issue_token(user).key
+
+    def delete_users(self, prefix):
+        """Delete the disposable users of a run, including those who signed up, with everything they wrote"""
+
+        users = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+        if not users:
+            return
+        with connection.cursor() as cur:
+            for table in ('transaction_history', 'user_folios', 'bank_details', 'user_info'):
+                cur.execute(f"delete from {table} where user_id = any(%s)", (users,))
+        User.objects.filter(id__in=users).delete()
+        self.stdout.write(f"Deleted {len(users)} disposable users")
+
+    def build_request(self, rng, name, funds, tokens, scratch):
+        """Method, path, body and headers of one request on a route"""
+
+        _, method, path, needs_token = TRAFFIC_MIX[name]
+        fund = rng.choice(funds)
+        if name == 'logout':
+            username, token = scratch['logout'].pop()
+        elif name in WRITE_ROUTES:
+            username, token = rng.choice(scratch['writes'])
+        else:
+            username, token = rng.choice(tokens)
+        path = path.format(fund=fund, search=urllib.parse.quote(rng.choice(SEARCHES)))
+        body = None
+        if name == 'add-transaction':
+            body = {'amfi_code': fund, 'trx_date': f'{TRAFFIC_YEAR}-{rng.randint(1, 12):02d}-10', 'trx_type': 'INV',
+                    'amount': 1000}
+        elif name == 'simulate-switch':
+            body = {'candidates': rng.sample(funds, min(5, len(funds)))}
+        elif name == 'check-email':
+            body = {'email': f'{username}@example.com'}
+        elif name == 'login':
+            body = {'username': username, 'password': PASSWORD}
+        elif name == 'add-folio':
+            body = {'amfi_code': fund}
+        elif name == 'add-bank':
+            body = {'bank_name': 'Load Test Bank', 'account_number': f'{rng.randrange(10 ** 12):012d}',
+                    'ifsc': 'LTST0000001'}
+        elif name == 'signup':
+            new_user = f"{scratch['prefix']}signup_{uuid.uuid4().hex[:12]}"
+            body = {'username': new_user, 'email': f'{new_user}@example.com', 'password': PASSWORD,
+                    'first_name': 'Load', 'last_name': 'Test', 'mobile': None, 'alt_mobile': None,
+                    'alt_email': None, 'pan': None, 'd_o_b': None}
+        headers = {'Content-Type': 'application/json'}
+        if needs_token:
+            headers['Authorization'] = f'Token {token}'
+        return name, method, path, body, headers
+
+    def send(self, base_url, request):
+        """Send one request, returning its route, status and latency"""
+
+        name, method, path, body, headers = request
+        data = json.dumps(body).encode() if body is not None else None
+        http_request = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(http_request, timeout=60) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        except (urllib.error.URLError, OSError):
+            status = None
+        return name, status, time.perf_counter() - started
+
+    def summarise(self, results, elapsed):
+        """Throughput, latency percentiles and error rate per route and overall"""
+
+        by_route = defaultdict(list)
+        for name, status, latency in results:
+            by_route[name].append((status, latency))
+        by_route['all'] = [(status, latency) for _, status, latency in results]
+
+        report = {'elapsed': elapsed, 'routes': {}}
+        for name, samples in sorted(by_route.items()):
+            latencies = sorted(i[1] for i in samples)
+            errors = sum(1 for status, _ in samples if status is None or status >= 400)
+            report['routes'][name] = {
+                'requests': len(samples),
+                'throughput': len(samples) / elapsed,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'error_rate': errors / len(samples),
+            }
+        return report
+
+    def print_report(self, report):
+        self.stdout.write(f"{'route':<20}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for name, route in report['routes'].items():
+            self.stdout.write(f"{name:<20}{route['requests']:>9}{route['throughput']:>9.1f}"
+                              f"{route['p50'] * 1000:>9.1f}{route['p95'] * 1000:>9.1f}{route['p99'] * 1000:>9.1f}"
+                              f"{route['error_rate']:>8.1%}")
+
+    def compare(self, report, baseline, tolerance):
+        """Print the changes against a baseline report and return the number of regressions"""
+
+        regressions = 0
+        self.stdout.write(f"\n{'route':<20}{'p95 change':>12}{'req/s change':>14}{'errors':>16}")
+        for name, route in report['routes'].items():
+            base = baseline['routes'].get(name)
+            if base is None:
+                continue
+            p95_change = route['p95'] / base['p95'] - 1 if base['p95'] else 0
+            throughput_change = route['throughput'] / base['throughput'] - 1 if base['throughput'] else 0
+            regressed = (p95_change > tolerance or throughput_change < -tolerance
+                         or route['error_rate'] > base['error_rate'] + 0.01)
+            regressions += regressed
+            line = (f"{name:<20}{p95_change:>+12.1%}{throughput_change:>+14.1%}"
+                    f"{base['error_rate']:>7.1%} -> {route['error_rate']:<6.1%}")
+            self.stdout.write(self.style.ERROR(line) if regressed else line)
+        return regressions
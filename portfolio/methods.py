@@ -1,12 +1,23 @@
 """Method for user portfolios"""
 
-import pandas as pd
-import numpy as np
+import csv
+import io
 
 from django.db import connection
 from django.db import IntegrityError
 
-from .utils import xirr_np
+from MfProject.lazy import lazy_import
+from MfProject.routers import read_connection, mark_write
+from funds.methods import nav_as_of
+from .cache import user_cached, invalidate_user
+from .utils import xirr_groups, encode_cursor, decode_cursor
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+TRANSACTIONS_PAGE_SIZE = 100
+TRANSACTIONS_MAX_PAGE_SIZE = 1000
+SWITCH_MAX_CANDIDATES = 50
 
 
 class UserInfo:
@@ -24,7 +35,7 @@ class UserInfo:
                     join user_info ui on au.id = ui.user_id
                     where id = %s
                     """
-        with connection.cursor() as cur:
+        with read_connection(self.user_id).cursor() as cur:
             cur.execute(info_query, (self.user_id,))
             result = cur.fetchone()
             keys = [i[0] for i in cur.description]
@@ -40,6 +51,7 @@ class UserInfo:
         try:
             with connection.cursor() as cur:
                 cur.execute(query, kwargs)
+            mark_write(self.user_id)
         except Exception as error:
             print(error)
             return False
@@ -48,6 +60,15 @@ class UserInfo:
     def get_folios(self, amfi_code=None):
         """Get all folios of a user"""
 
+        if amfi_code is None:
+            return self._all_folios()
+        return self._fetch_folios(amfi_code)
+
+    @user_cached('folios')
+    def _all_folios(self):
+        return self._fetch_folios()
+
+    def _fetch_folios(self, amfi_code=None):
         query = """select * from user_folios uf
                     join amc_master am on am.amc_id = uf.amc_id
                     where uf.user_id = %s
@@ -56,15 +77,17 @@ class UserInfo:
         if amfi_code is not None:
             params.append(amfi_code)
             query += 'and am.amc_id = (select amc_id from fund_master fm where amfi_code = %s)'
-        folios = pd.read_sql_query(query, connection, params=params)
+        folios = pd.read_sql_query(query, read_connection(self.user_id), params=params)
         if len(folios) == 0:
             return "No folios found"
         return folios.to_dict(orient='records')
 
+    @user_cached('banks')
     def get_banks(self):
         """Get all banks of a user"""
 
-        banks = pd.read_sql_query("select * from bank_details where user_id = %s", connection, params=[self.user_id])
+        banks = pd.read_sql_query("select * from bank_details where user_id = %s", read_connection(self.user_id),
+                                  params=[self.user_id])
         return banks.to_dict(orient='records')
 
 
@@ -80,14 +103,17 @@ class UserInvestmentManager(UserInfo):
             values (%(user_id)s, %(amfi_code)s, %(folio)s, %(trx_type)s, %(trx_date)s, %(nav)s, %(amount)s, %(units)s)
             returning trans_id, amfi_code, folio, amount, nav, units
         """
-        nav_query = """select * from nav_history
-                        where amfi_code = %s and date > %s
-                        order by date limit 1
-                    """
-        with connection.cursor() as cur:
-            cur.execute(nav_query, [kwargs['amfi_code'], kwargs['trx_date']])
-            records = cur.fetchall()
-            kwargs['nav'] = records[0][2]
+        try:
+            kwargs['amfi_code'] = int(kwargs['amfi_code'])
+        except (TypeError, ValueError):
+            return {'message': "Provide a numeric amfi_code", 'status': 400}
+        try:
+            kwargs['nav'] = nav_as_of([(kwargs['amfi_code'], kwargs['trx_date'])], after=True)[0][3]
+        except ValueError:
+            return {'message': "Provide trx_date as YYYY-MM-DD", 'status': 400}
+        if kwargs['nav'] is None:
+            return {'message': f"No NAV is available for {kwargs['amfi_code']} after {kwargs['trx_date']}",
+                    'status': 400}
 
         if 'trx_type' not in kwargs:
             kwargs['trx_type'] = 'INV'
@@ -115,6 +141,8 @@ class UserInvestmentManager(UserInfo):
             with connection.cursor() as cur:
                 cur.execute(insert_query, kwargs)
                 result = cur.fetchone()
+            mark_write(self.user_id)
+            invalidate_user(self.user_id, 'analytics')
             return {'message': 'Transaction created successfully', 'status': 201, 'transaction': result}
         except Exception as error:
             print(error)
@@ -159,6 +187,8 @@ class UserInvestmentManager(UserInfo):
             with connection.cursor() as cursor:
                 cursor.execute(create_query, params)
                 folio = cursor.fetchone()
+            mark_write(self.user_id)
+            invalidate_user(self.user_id, 'folios')
             return {'message': "Folio created successfully", "status": 201, "folio": folio}
         except Exception as error:
             print(error)
@@ -181,6 +211,8 @@ class UserInvestmentManager(UserInfo):
             with connection.cursor() as cur:
                 cur.execute(insert_query, (self.user_id, bank_name, account_number, ifsc, is_primary))
                 bank_id = cur.fetchone()
+            mark_write(self.user_id)
+            invalidate_user(self.user_id, 'banks')
             return {'message': "Bank addition successful", 'status': 201, 'bank_id': bank_id[0]}
         except IntegrityError as error:
             print(error)
@@ -195,12 +227,11 @@ class UserPortfolio(UserInfo):
 
     def __init__(self, user_id):
         UserInfo.__init__(self, user_id)
-        self.trx_hist = None
         self.navs = None
 
     trx_hist_query = """
         select th.trans_id, th.user_id, am.amc, fm.amfi_code, fm.fund_name, th.folio, th.trx_type,
-                th.trx_date, th.amount, th.nav, th.units, lnav.nav, lnav.nav*th.units as value,
+                th.trx_date, th.amount, lnav.nav, th.units, lnav.nav*th.units as value,
                 fm.cg_category, current_date-trx_date as holding_period
             from transaction_history th
                 join fund_master fm on th.amfi_code = fm.amfi_code
@@ -214,93 +245,238 @@ class UserPortfolio(UserInfo):
                         select distinct amfi_code from transaction_history th where user_id = %s
                     )"""
 
-    holdings_query = """
-            with holdings as (
-                select th.amfi_code, lnav.fund_name, trx_date as date, amount, th.nav, lnav.nav as latest_nav, units
-                    from transaction_history th
-                    join latest_nav lnav on th.amfi_code = lnav.amfi_code
-                    where user_id = %s
-                )
-            select * from (
-                select amfi_code, fund_name, current_date -1 as date,
-                    latest_nav as nav, -sum(units) as units, -(sum(units)*latest_nav)::float as amount
-                    from holdings
-                    group by amfi_code, fund_name, latest_nav
-                ) t1 where abs(units) > 0.1
-            union
-            select amfi_code, fund_name, date, nav, units::float, amount from holdings
-            order by amfi_code, date
-            """
-
-    @property
-    def transaction_history(self):
-        """Fetch the transaction history for a user"""
+    analytics_query = """
+        select th.amfi_code, lnav.fund_name, fm.amc, fm.category, fm.sub_category, fm.fund_plan,
+                th.trx_date as date, th.amount::float as amount, th.units::float as units,
+                lnav.nav::float as nav, current_date - 1 as value_date
+            from transaction_history th
+                join latest_nav lnav on th.amfi_code = lnav.amfi_code
+                join fund_master fm on th.amfi_code = fm.amfi_code
+            where th.user_id = %s
+            order by th.amfi_code, th.trx_date"""
 
-        if self.trx_hist is None:
-            with connection.cursor() as cur:
-                cur.execute(self.trx_hist_query, (self.user_id,))
-                results = cur.fetchall()
-                keys = [i[0] for i in cur.description]
-            all_trx = []
-            for i in results:
-                all_trx.append(dict(zip(keys, i)))
-            self.trx_hist = all_trx
-        return self.trx_hist
+    # Allocation name: fund_master column it groups holdings by
+    allocation_columns = {'category': 'category', 'sub_category': 'sub_category', 'amc': 'amc', 'plan': 'fund_plan'}
 
-    def fetch_portfolio(self):
-        """Fetch the portfoio for a user with XIRR"""
+    def _transactions_query(self, amfi_code=None, folio=None, trx_type=None, date_from=None, date_to=None):
+        """Transaction history query of the user with the given filters, newest first"""
 
-        with connection.cursor() as cur:
-            cur.execute(self.holdings_query, (self.user_id,))
-            holdings = cur.fetchall()
+        query = self.trx_hist_query
+        params = [self.user_id]
+        filters = [('th.amfi_code = %s', amfi_code), ('th.folio = %s', folio), ('th.trx_type = %s', trx_type),
+                   ('th.trx_date >= %s', date_from), ('th.trx_date <= %s', date_to)]
+        for condition, value in filters:
+            if value is not None:
+                query += f' and {condition}'
+                params.append(value)
+        return query, params
+
+    def transactions(self, cursor=None, limit=TRANSACTIONS_PAGE_SIZE, **filters):
+        """A page of the user's transactions, newest first, and the cursor of the next page if there is one.
+            Pages are found by seeking to the (trx_date, trans_id) of the cursor, so deep pages cost
+            as little as the first one."""
+
+        limit = max(1, min(int(limit), TRANSACTIONS_MAX_PAGE_SIZE))
+        query, params = self._transactions_query(**filters)
+        if cursor is not None:
+            query += ' and (th.trx_date, th.trans_id) < (%s, %s)'
+            params.extend(decode_cursor(cursor))
+        query += ' order by th.trx_date desc, th.trans_id desc limit %s'
+        params.append(limit + 1)
+
+        with read_connection(self.user_id).cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            keys = [i[0] for i in cur.description]
+        results = [dict(zip(keys, i)) for i in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(results[-1]['trx_date'], results[-1]['trans_id'])
+        return {'results': results, 'next': next_cursor}
+
+    def export_transactions(self, **filters):
+        """All of the user's transactions with the given filters as CSV lines, read through a
+            server side cursor so that the history is never held in memory at once"""
+
+        query, params = self._transactions_query(**filters)
+        query += ' order by th.trx_date desc, th.trans_id desc'
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        with read_connection(self.user_id).chunked_cursor() as cur:
+            cur.execute(query, params)
+            writer.writerow([i[0] for i in cur.description])
+            while True:
+                rows = cur.fetchmany(2000)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    @user_cached('analytics')
+    def portfolio_analytics(self):
+        """Holdings with XIRR per fund, the portfolio summary, and allocations by category, sub-category,
+            AMC and plan, all computed from one scan of the user's transactions"""
+
+        trx = pd.read_sql_query(self.analytics_query, read_connection(self.user_id), params=[self.user_id])
+        if trx.empty:
+            return {'funds': [],
+                    'summary': {'xirr': "XIRR not calculated", 'investment': 0, 'value': 0, 'num_funds': 0},
+                    'allocation': {i: [] for i in self.allocation_columns}}
+
+        funds = trx.groupby('amfi_code').agg(
+            fund_name=('fund_name', 'first'), amc=('amc', 'first'), category=('category', 'first'),
+            sub_category=('sub_category', 'first'), fund_plan=('fund_plan', 'first'), date=('value_date', 'first'),
+            nav=('nav', 'first'), units=('units', 'sum'), cost=('amount', 'sum'),
+        )
+        funds = funds[funds['units'].abs() > 0.1].copy()
+        funds['value'] = funds['units'] * funds['nav']
+        funds['profit'] = funds['value'] - funds['cost']
+
+        # The cashflows of each held fund, then all cashflows for the portfolio, each closed by the
+        # current values, so that every XIRR is solved in one batch
+        held = trx[trx['amfi_code'].isin(funds.index)]
+        count = len(funds)
+        value_dates = np.array(funds['date'].tolist(), dtype='datetime64[D]')
+        values = -funds['value'].values
+        groups = np.concatenate([funds.index.get_indexer(held['amfi_code']), np.arange(count),
+                                 np.full(len(trx) + count, count)])
+        dates = np.concatenate([np.array(held['date'].tolist(), dtype='datetime64[D]'), value_dates,
+                                np.array(trx['date'].tolist(), dtype='datetime64[D]'), value_dates])
+        amounts = np.concatenate([held['amount'].values, values, trx['amount'].values, values])
+        xirrs = xirr_groups(groups, dates, amounts)
+        xirrs = [None if np.isnan(i) else float(i) for i in xirrs]
+        funds['xirr'] = [i if i is not None else "XIRR not calculated" for i in xirrs[:count]]
+
+        total = funds['value'].sum()
+        allocation = {}
+        for name, column in self.allocation_columns.items():
+            groups = funds.fillna({column: 'Unknown'}).groupby(column)[['value', 'cost']].sum()
+            groups['weight'] = groups['value'] / total if total else 0.0
+            groups = groups.sort_values('value', ascending=False).rename_axis('name').reset_index()
+            allocation[name] = groups.to_dict(orient='records')
 
-        holdings = np.array(holdings)
         keys = ['amfi_code', 'fund_name', 'date', 'nav', 'units', 'value', 'cost', 'xirr', 'profit']
+        return {
+            'funds': funds.reset_index()[keys].to_dict(orient='records'),
+            'summary': {
+                'xirr': xirrs[count] if xirrs[count] is not None else "XIRR not calculated",
+                'investment': float(funds['cost'].sum()),
+                'value': float(total),
+                'num_funds': count,
+            },
+            'allocation': allocation,
+        }
 
-        all_xirrs = []
-        for i in np.unique(holdings[:, 0]):
-            holdings_slice = holdings[holdings[:, 0] == i]
-            cur_xirr = xirr_np(holdings_slice[:, 2], holdings_slice[:, 5])
-            cur_holdings = list(holdings_slice[-1, :])
-            cur_holdings[4] *= -1
-            cur_holdings[5] *= -1
-            cost = sum(holdings_slice[:-1, 5])
-            cur_holdings.append(cost)
-            cur_holdings.append(cur_xirr)
-
-            profit = cur_holdings[5]-cur_holdings[6]
-            cur_holdings.append(profit)
-            all_xirrs.append(dict(zip(keys, cur_holdings)))
+    def fetch_portfolio(self):
+        """Fetch the portfoio for a user with XIRR"""
 
-        return all_xirrs
+        return self.portfolio_analytics()['funds']
 
     @property
     def all_navs(self):
         """Fetch NAVs of all funds held by the user"""
 
         if self.navs is None:
-            self.navs = pd.read_sql_query(self.all_navs_query, connection,
+            self.navs = pd.read_sql_query(self.all_navs_query, read_connection(self.user_id),
                                           params=[self.user_id], parse_dates='date')
         return self.navs
 
     def portfolio_xirr(self):
         """Fetch the portfolio XIRR"""
 
-        with connection.cursor() as cur:
-            cur.execute(self.holdings_query, (self.user_id,))
-            holdings = cur.fetchall()
-        holdings = np.array(holdings)
-        xirr_perc = xirr_np(holdings[:, 2], holdings[:, 5])
-        return xirr_perc
+        return self.portfolio_analytics()['summary']['xirr']
 
     def investment_summary(self):
         """Fetch the investment summary for a user"""
 
-        portfolio_summary = self.fetch_portfolio()
-        investment_summary = {
-            'xirr': self.portfolio_xirr(),
-            'investment': sum([i['cost'] for i in portfolio_summary]),
-            'value': sum([i['value'] for i in portfolio_summary]),
-            'num_funds': len(portfolio_summary)
+        return self.portfolio_analytics()['summary']
+
+    def allocation(self):
+        """Current value, cost and weight of the holdings by category, sub-category, AMC and plan"""
+
+        return self.portfolio_analytics()['allocation']
+
+    def simulate_switch(self, candidates, amfi_codes=None, trans_ids=None, date_from=None, date_to=None):
+        """What the user's cashflows would be worth had they gone into each candidate fund instead.
+            The cashflows are the user's transactions, or those in amfi_codes, trans_ids or the date range.
+            Each is replayed at the candidate's NAV as of its date, found the way add_transaction finds NAVs,
+            and all candidates are valued and their XIRRs solved together with the actual holdings.
+            Cashflows of funds without a latest NAV can't be valued and are left out, as are candidates without
+            one, and both are listed in the result."""
+
+        candidates = [int(i) for i in candidates]
+        query = """select th.amfi_code, th.trx_date as date, th.amount::float as amount, th.units::float as units
+                    from transaction_history th where th.user_id = %(user_id)s"""
+        params = {'user_id': self.user_id}
+        filters = [('th.amfi_code = any(%(amfi_codes)s::int[])', 'amfi_codes', amfi_codes),
+                   ('th.trans_id = any(%(trans_ids)s::bigint[])', 'trans_ids', trans_ids),
+                   ('th.trx_date >= %(date_from)s', 'date_from', date_from),
+                   ('th.trx_date <= %(date_to)s', 'date_to', date_to)]
+        for condition, name, value in filters:
+            if value is not None:
+                query += f' and {condition}'
+                params[name] = value
+        query += ' order by th.trx_date'
+        flows = pd.read_sql_query(query, read_connection(self.user_id), params=params)
+        if flows.empty:
+            return {'message': "No transactions to simulate", 'status': 400}
+
+        latest_query = """select amfi_code, fund_name, nav::float as nav, current_date - 1 as value_date
+                            from latest_nav where amfi_code = any(%s::int[])"""
+        latest = pd.read_sql_query(latest_query, read_connection(self.user_id),
+                                   params=[list(set(candidates) | set(flows['amfi_code']))], index_col='amfi_code')
+        skipped_candidates = [i for i in candidates if i not in latest.index]
+        candidates = [i for i in candidates if i in latest.index]
+        valued = flows['amfi_code'].isin(latest.index)
+        excluded_funds = sorted(int(i) for i in flows.loc[~valued, 'amfi_code'].unique())
+        flows = flows[valued].reset_index(drop=True)
+        if flows.empty:
+            return {'message': "None of the transactions are in funds with a latest NAV", 'status': 400,
+                    'excluded_funds': excluded_funds}
+        if not candidates:
+            return {'message': "None of the candidates have a latest NAV", 'status': 400,
+                    'skipped_candidates': skipped_candidates}
+
+        # One as-of lookup for every (candidate, cashflow date) pair, as a candidates x cashflows matrix
+        count = len(flows)
+        navs = nav_as_of([(code, date) for code in candidates for date in flows['date']], after=True)
+        navs = np.array([np.nan if i[3] is None else float(i[3]) for i in navs]).reshape(len(candidates), count)
+        units = flows['amount'].values / navs
+        found = ~np.isnan(units)
+        values = np.nansum(units, axis=1) * latest['nav'].reindex(candidates).values
+        invested = np.where(found, flows['amount'].values, 0).sum(axis=1)
+
+        actual_value = (flows['units'].values * latest['nav'].reindex(flows['amfi_code']).values).sum()
+        value_date = np.datetime64(latest['value_date'].iloc[0], 'D')
+        dates = np.array(flows['date'].tolist(), dtype='datetime64[D]')
+
+        # Series 0 is the actual cashflows, series k the cashflows replayed into candidate k
+        rows, columns = np.nonzero(found)
+        groups = np.concatenate([np.zeros(count, dtype=int), rows + 1, np.arange(len(candidates) + 1)])
+        xirr_dates = np.concatenate([dates, dates[columns], np.full(len(candidates) + 1, value_date)])
+        amounts = np.concatenate([flows['amount'].values, flows['amount'].values[columns],
+                                  [-actual_value], -values])
+        xirrs = [float(i) if not np.isnan(i) else "XIRR not calculated" for i in xirr_groups(groups, xirr_dates, amounts)]
+
+        results = [{
+            'amfi_code': code,
+            'fund_name': latest.at[code, 'fund_name'],
+            'invested': float(invested[k]),
+            'value': float(values[k]),
+            'profit': float(values[k] - invested[k]),
+            'xirr': xirrs[k + 1],
+            'missing_navs': int(count - found[k].sum()),
+        } for k, code in enumerate(candidates)]
+        invested_actual = float(flows['amount'].sum())
+        return {
+            'status': 200,
+            'cashflows': count,
+            'actual': {'invested': invested_actual, 'value': float(actual_value),
+                       'profit': float(actual_value - invested_actual), 'xirr': xirrs[0]},
+            'candidates': sorted(results, key=lambda i: i['value'], reverse=True),
+            'excluded_funds': excluded_funds,
+            'skipped_candidates': skipped_candidates,
         }
-        return investment_summary
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Index matching the order of paginated transaction history, so each page is one index range scan"""
+
+    atomic = False
+
+    dependencies = []
+
+    operations = [
+        migrations.RunSQL(
+            "create index concurrently if not exists transaction_history_user_date_idx "
+            "on transaction_history (user_id, trx_date, trans_id)",
+            "drop index concurrently if exists transaction_history_user_date_idx",
+        ),
+    ]
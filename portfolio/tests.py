@@ -1,3 +1,139 @@
-from django.test import TestCase
+import datetime
+import json
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from . import authentication
+from .authentication import CachedTokenAuthentication, on_token_deleted, on_user_saved
+from .utils import xirr_groups
+from .views import AuthenticationView
+
+
+def cashflows(*series):
+    """groups, dates and amounts arrays of cashflow series, each a list of (date, amount)"""
+
+    groups = np.array([number for number, flows in enumerate(series) for _ in flows])
+    dates = np.array([date for flows in series for date, _ in flows], dtype='datetime64[D]')
+    amounts = np.array([amount for flows in series for _, amount in flows], dtype=float)
+    return groups, dates, amounts
+
+
+class XirrGroupsTests(SimpleTestCase):
+    """XIRR of many cashflow series solved together"""
+
+    def test_single_group(self):
+        rates = xirr_groups(*cashflows([('2021-01-01', -1000), ('2022-01-01', 1100)]))
+        self.assertAlmostEqual(rates[0], 0.1, places=6)
+
+    def test_several_groups(self):
+        sip = [('2021-01-01', -1000), ('2021-07-01', -1000), ('2022-01-01', -1000), ('2023-01-01', 3500)]
+        groups, dates, amounts = cashflows(
+            [('2021-01-01', -1000), ('2023-01-01', 1210)],
+            sip,
+            [('2021-01-01', -1000), ('2022-01-01', 800)],
+        )
+        rates = xirr_groups(groups, dates, amounts)
+        self.assertAlmostEqual(rates[0], 0.1, places=6)
+        self.assertAlmostEqual(rates[2], -0.2, places=6)
+        # The rate of the SIP discounts its cashflows to zero, and matches solving the SIP alone
+        years = (dates[groups == 1] - dates[groups == 1][0]) / np.timedelta64(365, 'D')
+        self.assertAlmostEqual(np.sum(amounts[groups == 1] * (1 + rates[1]) ** -years), 0, places=4)
+        self.assertAlmostEqual(rates[1], xirr_groups(*cashflows(sip))[0], places=9)
+
+    def test_no_solution(self):
+        # Only investments, and a single cashflow, have no rate at which they are worth nothing
+        rates = xirr_groups(*cashflows(
+            [('2021-01-01', -1000), ('2022-01-01', -1000)],
+            [('2021-01-01', -1000)],
+            [('2021-01-01', -1000), ('2022-01-01', 1100)],
+        ))
+        self.assertTrue(np.isnan(rates[0]))
+        self.assertTrue(np.isnan(rates[1]))
+        self.assertAlmostEqual(rates[2], 0.1, places=6)
+
+
+@override_settings(TOKEN_CACHE_TTL=60, TOKEN_CACHE_SIZE=100, TOKEN_EXPIRY=None, CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'portfolio': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-portfolio'},
+})
+class CachedTokenAuthenticationTests(SimpleTestCase):
+    """Token lookups cached per process, with the tokens standing in for the authtoken table"""
+
+    def setUp(self):
+        authentication._tokens.clear()
+        self.user = mock.Mock(pk=1, id=1, is_active=True)
+        self.tokens = {}
+        self.token = self.add_token('first-key')
+
+        lookup = mock.patch.object(TokenAuthentication, 'authenticate_credentials', autospec=True,
+                                   side_effect=self.lookup)
+        self.lookups = lookup.start()
+        self.addCleanup(lookup.stop)
+        # on_user_saved lists the keys of the user's tokens
+        manager = mock.patch.object(Token, 'objects')
+        self.objects = manager.start()
+        self.addCleanup(manager.stop)
+        self.objects.filter.return_value.values_list.side_effect = lambda *args, **kwargs: list(self.tokens)
+
+    def add_token(self, key, created=None):
+        token = mock.Mock(key=key, user=self.user, created=created or timezone.now())
+        token.delete.side_effect = lambda: self.tokens.pop(key, None)
+        self.tokens[key] = token
+        return token
+
+    def lookup(self, auth, key):
+        """TokenAuthentication.authenticate_credentials, looking up self.tokens"""
+
+        if key not in self.tokens:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not self.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return self.user, self.tokens[key]
+
+    def authenticate(self, key):
+        return CachedTokenAuthentication().authenticate_credentials(key)
+
+    def test_cache_hit(self):
+        self.assertEqual(self.authenticate('first-key'), (self.user, self.token))
+        self.assertEqual(self.authenticate('first-key'), (self.user, self.token))
+        self.assertEqual(self.lookups.call_count, 1)
+
+    def test_deactivated_user(self):
+        self.authenticate('first-key')
+        self.user.is_active = False
+        on_user_saved(sender=None, instance=self.user)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate('first-key')
+
+    def test_deleted_token(self):
+        self.authenticate('first-key')
+        self.token.delete()
+        on_token_deleted(sender=Token, instance=self.token)
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate('first-key')
+
+    @override_settings(TOKEN_EXPIRY=3600)
+    def test_expired_token_and_login(self):
+        expired = self.add_token('old-key', created=timezone.now() - datetime.timedelta(hours=2))
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate('old-key')
+        self.assertNotIn('old-key', self.tokens)
+
+        # Logging in while the expired token still exists replaces it with a working one
+        self.add_token('old-key', created=expired.created)
+        self.objects.get_or_create.return_value = (self.tokens['old-key'], False)
+        self.objects.create.side_effect = lambda user: self.add_token('new-key')
+        request = APIRequestFactory().post('/users/login/', json.dumps({'username': 'user', 'password': 'secret'}),
+                                           content_type='application/json')
+        with mock.patch('portfolio.views.authenticate', return_value=self.user):
+            response = AuthenticationView.as_view()(request)
+        self.assertEqual(response.data, {'Token': 'new-key'})
+        self.assertNotIn('old-key', self.tokens)
+        self.assertEqual(self.authenticate('new-key'), (self.user, self.tokens['new-key']))
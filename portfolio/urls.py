@@ -7,11 +7,14 @@ urlpatterns = [
     path('transactions', views.UserTransaction.as_view()),
     path('portfolio', views.user_portfolio),
     path('investment-summary', views.user_investment_summary),
+    path('allocation', views.user_allocation),
+    path('simulate-switch', views.simulate_switch),
     path('folios/<int:amfi_code>', views.UserFolios.as_view()),
     path('folios', views.UserFolios.as_view()),
     path('banks', views.UserBanks.as_view()),
 
     path('check-email/', views.check_email),
     path('login/', views.AuthenticationView.as_view()),
+    path('logout/', views.logout),
     path('signup/', views.user_registration),
 ]
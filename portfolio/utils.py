@@ -1,6 +1,12 @@
 """Defines utility functions for user with methods.py"""
 
-import numpy as np
+import base64
+import datetime
+import json
+
+from MfProject.lazy import lazy_import
+
+np = lazy_import('numpy')
 
 
 def xirr_np(dates, amounts, guess=0.05, step=0.05):
@@ -28,3 +34,46 @@ def xirr_np(dates, amounts, guess=0.05, step=0.05):
         else:
             return guess
     return "XIRR not calculated"
+
+
+def xirr_groups(groups, dates, amounts, guess=0.1, tolerance=1e-6, limit=100):
+    """XIRR of many cashflow series at once, by Newton's method over all of them in each step.
+        groups holds the series number, from 0, of each cashflow. Returns an array with the XIRR
+        of each series, NaN where it did not converge."""
+
+    count = groups.max() + 1
+    dates = dates.astype('datetime64[D]')
+    start = np.full(count, dates.max())
+    np.minimum.at(start, groups, dates)
+    years = (dates - start[groups]) / np.timedelta64(365, 'D')
+
+    rates = np.full(count, guess, dtype=float)
+    converged = np.zeros(count, dtype=bool)
+    for _ in range(limit):
+        discounted = amounts * (1 + rates[groups]) ** -years
+        npv = np.bincount(groups, discounted, count)
+        slope = np.bincount(groups, -years * discounted / (1 + rates[groups]), count)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = np.where(slope != 0, npv / slope, np.nan)
+        converged = np.abs(step) < tolerance
+        rates = np.where(converged, rates, np.clip(rates - step, -0.9999, None))
+        if converged.all():
+            break
+    rates[~converged] = np.nan
+    return rates
+
+
+def encode_cursor(trx_date, trans_id):
+    """Opaque pagination cursor for the position of a transaction"""
+
+    return base64.urlsafe_b64encode(json.dumps([trx_date.isoformat(), trans_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """The (trx_date, trans_id) of a cursor from encode_cursor. Raises ValueError if it is not one."""
+
+    try:
+        trx_date, trans_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.date.fromisoformat(trx_date), int(trans_id)
+    except (TypeError, ValueError, UnicodeDecodeError, json.JSONDecodeError) as error:
+        raise ValueError(f"Invalid cursor: {cursor}") from error
@@ -1,8 +1,9 @@
 """Views for user authentication, info, and portfolios"""
 
+import datetime
 import json
 
-from django.http import JsonResponse, HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 
@@ -10,9 +11,11 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.authtoken.models import Token
 
-from .methods import UserInfo, UserInvestmentManager, UserPortfolio
+from MfProject.renderers import FastJsonResponse
+
+from .authentication import issue_token
+from .methods import UserInfo, UserInvestmentManager, UserPortfolio, TRANSACTIONS_PAGE_SIZE, SWITCH_MAX_CANDIDATES
 
 
 @api_view(['GET'])
@@ -22,7 +25,7 @@ def user(request):
 
     user = UserInfo(request.user.id)
     info = user.info()
-    return JsonResponse(info, safe=False)
+    return FastJsonResponse(info)
 
 
 class UserTransaction(APIView):
@@ -30,12 +33,36 @@ class UserTransaction(APIView):
 
     permission_classes = (IsAuthenticated,)
 
-    def get(self, request):
-        """get user transactions"""
+    # Filter: function parsing its query parameter, raising ValueError if the value is invalid
+    filters = {
+        'amfi_code': int,
+        'folio': str,
+        'trx_type': str,
+        'date_from': datetime.date.fromisoformat,
+        'date_to': datetime.date.fromisoformat,
+    }
 
-        user_id = request.user.id
-        user = UserPortfolio(user_id)
-        result = user.transaction_history
+    def get(self, request):
+        """get a page of user transactions, or all of them as CSV with ?export=csv"""
+
+        user = UserPortfolio(request.user.id)
+        filters = {}
+        for name, parse in self.filters.items():
+            value = request.query_params.get(name)
+            try:
+                filters[name] = None if value is None else parse(value)
+            except ValueError:
+                return Response({'message': f"Invalid {name}: {value}. Provide a numeric amfi_code "
+                                            f"and dates as YYYY-MM-DD"}, status=400)
+        if request.query_params.get('export') == 'csv':
+            response = StreamingHttpResponse(user.export_transactions(**filters), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="transactions.csv"'
+            return response
+        try:
+            result = user.transactions(request.query_params.get('cursor'),
+                                       request.query_params.get('limit', TRANSACTIONS_PAGE_SIZE), **filters)
+        except ValueError as error:
+            return Response({'message': str(error)}, status=400)
         return Response(result)
 
     def post(self, request):
@@ -51,13 +78,13 @@ class UserTransaction(APIView):
         if all(val in body for val in required_vals) and any(val in body for val in one_reqd_val):
             user = UserInvestmentManager(user_id)
             response = user.add_transaction(**body)
+            return Response(response, status=response.pop('status'))
         else:
             error = (f"Error: All required fields are not present."
                      f" Please provide all of {', '.join(required_vals)}"
                      f" and any one of {' or '.join(one_reqd_val)}")
 
             return Response({'message': error}, status=400)
-        return Response(response)
 
 
 @api_view(['GET'])
@@ -98,6 +125,57 @@ def user_investment_summary(request):
     return Response(result)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def user_allocation(request):
+    """Allocation of a user's holdings by category, sub-category, AMC and plan"""
+
+    user = UserPortfolio(request.user.id)
+    result = user.allocation()
+    return Response(result)
+
+
+def _int_list(value):
+    """A list of integers from a JSON list of numbers or numeric strings, or None if it is not one"""
+
+    if not isinstance(value, list) or any(isinstance(i, (bool, float)) for i in value):
+        return None
+    try:
+        return [int(i) for i in value]
+    except (TypeError, ValueError):
+        return None
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def simulate_switch(request):
+    """Compare the user's cashflows replayed into candidate funds with their actual holdings"""
+
+    body_unicode = request.body.decode('utf-8')
+    body = json.loads(body_unicode)
+    candidates = _int_list(body.get('candidates'))
+    if not candidates:
+        return Response({'message': "Provide a list of candidate amfi_codes"}, status=400)
+    if len(candidates) > SWITCH_MAX_CANDIDATES:
+        return Response({'message': f"Provide at most {SWITCH_MAX_CANDIDATES} candidates"}, status=400)
+    filters = {}
+    for name in ('amfi_codes', 'trans_ids'):
+        if body.get(name) is not None:
+            filters[name] = _int_list(body[name])
+            if filters[name] is None:
+                return Response({'message': f"Provide {name} as a list of numbers"}, status=400)
+    for name in ('date_from', 'date_to'):
+        if body.get(name) is not None:
+            try:
+                filters[name] = datetime.date.fromisoformat(body[name])
+            except (TypeError, ValueError):
+                return Response({'message': f"Provide {name} as YYYY-MM-DD"}, status=400)
+    user = UserPortfolio(request.user.id)
+    result = user.simulate_switch(candidates, **filters)
+    status = result.pop('status')
+    return Response(result, status=status)
+
+
 class UserFolios(APIView):
     """This class allows fetching, adding, and updating of user folios"""
 
@@ -168,10 +246,19 @@ class AuthenticationView(APIView):
         user = authenticate(username=username, password=password)
         if not user:
             return Response({'Error': 'Invalid userid or password'}, status=401)
-        token, _ = Token.objects.get_or_create(user=user)
+        token = issue_token(user)
         return Response({'Token': token.key})
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def logout(request):
+    """Logout a user by deleting their token"""
+
+    request.auth.delete()
+    return Response(status=204)
+
+
 @api_view(['POST'])
 def check_email(request):
     """Check if an email is available at the time of signup"""